@@ -1,6 +1,13 @@
 import os
+import threading
 from openai import OpenAI
 from datetime import datetime
+from concurrent.futures import Future
+from segment_aligner import build_aligned_segments, format_aligned_content, split_windows
+from llm_dispatcher import estimate_tokens, load_dispatcher
+from llm_cache import load_llm_cache, print_cache_stats
+from llm_stream import TABLE_SEPARATOR, complete_chat, write_stream
+from usage_meter import load_usage_meter
 
 def get_latest_folder(directory):
     """获取目录中最新的文件夹（按修改时间排序）"""
@@ -24,11 +31,11 @@ def get_latest_folder(directory):
         return None
 
 def get_files_from_folder(folder, count=2):
-    """从文件夹中获取最新的两个文件（按修改时间排序）"""
+    """从文件夹中获取最新的两个文本文件（按修改时间排序）"""
     try:
         files = []
         for entry in os.scandir(folder):
-            if entry.is_file():
+            if entry.is_file() and entry.name.endswith('.txt'):
                 mtime = entry.stat().st_mtime
                 files.append((entry.path, mtime))
         
@@ -56,63 +63,207 @@ def load_config():
     with open('src/config.json', 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def process_with_deepseek(config, content):
-    """使用DeepSeek API处理内容"""
-    client = OpenAI(api_key=config['ai_auto_processor']['api_key'], 
-                  base_url=config['ai_auto_processor']['base_url'])
-    
+def build_messages(config, content):
+    """按config中的系统提示词和用户提示模板构建对话消息"""
     # 从config获取用户提示模板
     user_prompt = config['ai_auto_processor']['prompts']['user_template'].format(content=content)
+    return [
+        {"role": "system", "content": config['ai_auto_processor']['system_prompt']},
+        {"role": "user", "content": user_prompt},
+    ]
+
+def process_with_deepseek(config, content, output_path=None, on_row=None, usage=None):
+    """使用DeepSeek API处理内容，相同请求优先使用缓存的回复
+
+    开启stream时边生成边写入output_path并输出到终端，每完成一个表格行调用on_row(row)；
+    usage(UsageRecorder)记录token数、耗时和估算费用
+    """
+    model = config['ai_auto_processor']['model']
+    messages = build_messages(config, content)
+    cache = load_llm_cache(config)
+    key = cache.make_key(model, messages) if cache else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            print("使用缓存的大模型回复")
+            if usage is not None:
+                usage.record(model, cached=True)
+            return write_stream([cached], output_path, on_row, echo=False)
+
+    client = OpenAI(api_key=config['ai_auto_processor']['api_key'], 
+                  base_url=config['ai_auto_processor']['base_url'])
     
-    response = client.chat.completions.create(
-        model=config['ai_auto_processor']['model'],
-        messages=[
-            {"role": "system", "content": config['ai_auto_processor']['system_prompt']},
-            {"role": "user", "content": user_prompt},
-        ],
-        stream=False
-    )
-    return response.choices[0].message.content
-
-def generate_report():
-    """生成分析报告"""
-    config = load_config()
+    result = complete_chat(client, model, messages, config['ai_auto_processor'].get('stream', True),
+                           output_path, on_row, recorder=usage)
+    if key is not None:
+        cache.put(key, model, result)
+    return result
+
+def split_content(ai_config, video_name, records):
+    """内容超过chunking.min_tokens时按时间窗口分段，返回每段的发送内容"""
+    chunking = ai_config.get('chunking', {})
+    content = format_aligned_content(video_name, records)
+    window = chunking.get('window_seconds', 0)
+    if not window or estimate_tokens(content) <= chunking.get('min_tokens', 0):
+        return [content]
+    windows = split_windows(records, window)
+    if len(windows) == 1:
+        return [content]
+    print(f"内容较长(约 {estimate_tokens(content)} tokens)，按 {window} 秒分为 {len(windows)} 段并行处理")
+    return [format_aligned_content(video_name, records, part=(idx + 1, len(windows)))
+            for idx, records in enumerate(windows)]
+
+def merge_chunk_results(results):
+    """按顺序合并各段返回的表格: 表头只保留一次，去掉段间重复的行
+
+    某段没有返回表格时原样保留其文本
+    """
+    if len(results) == 1:
+        return results[0]
+    header = []
+    rows = []
+    for result in results:
+        lines = [line.strip() for line in result.splitlines()]
+        has_table = False
+        for idx, line in enumerate(lines):
+            if not line.startswith('|') or TABLE_SEPARATOR.match(line):
+                continue
+            has_table = True
+            if idx + 1 < len(lines) and TABLE_SEPARATOR.match(lines[idx + 1]):
+                # 表头
+                if not header:
+                    header = [line, lines[idx + 1]]
+                continue
+            if not rows or rows[-1] != line:
+                rows.append(line)
+        if not has_table and result.strip():
+            rows.append(result.strip())
+    return "\n".join(header + rows)
+
+def prepare_report(config, folder=None):
+    """确定分析文件夹并整理发送给大模型的内容，返回(文件夹, [各段内容])，失败时返回None
+
+    folder为video_analyzer生成的分析文件夹(output/视频名)；批处理中各集显式传入，
+    未指定时才使用output目录中最新的文件夹
+    """
     ai_config = config['ai_auto_processor']
     
-    # 1. 获取最新文件夹及其中的文件
-    latest_folder = get_latest_folder(ai_config['output_dir'])
+    # 1. 确定分析文件夹
+    latest_folder = folder or get_latest_folder(ai_config['output_dir'])
     if not latest_folder:
         print("错误：output目录中没有文件夹")
-        return
-    
-    latest_files = get_files_from_folder(latest_folder, ai_config['max_files'])
-    if len(latest_files) < ai_config['max_files']:
-        print(f"错误：文件夹 {os.path.basename(latest_folder)} 中文件不足")
-        return
-    
-    # 2. 读取文件内容
-    content = ""
-    for filepath in latest_files:
-        content += f"\n\n=== 文件: {os.path.basename(filepath)} ===\n"
-        content += read_file_content(filepath)
-    
-    # 3. 调用DeepSeek处理
-    print("正在使用ai大模型处理内容...")
-    analysis_result = process_with_deepseek(config, content)
+        return None
     
-    # 4. 生成报告文件 - 放在项目根目录的"ai视频设备报告"文件夹
+    # 2. 在本地按时间把镜头分析与字幕对齐；缺少字幕时间轴时退回到拼接原始文件
+    records = build_aligned_segments(latest_folder) if ai_config.get('align_subtitles', True) else None
+    if records:
+        contents = split_content(ai_config, os.path.basename(latest_folder), records)
+        print(f"已对齐 {len(records)} 个片段与字幕，共 {sum(len(c) for c in contents)} 字")
+    else:
+        latest_files = get_files_from_folder(latest_folder, ai_config['max_files'])
+        if len(latest_files) < ai_config['max_files']:
+            print(f"错误：文件夹 {os.path.basename(latest_folder)} 中文件不足")
+            return None
+        
+        content = ""
+        for filepath in latest_files:
+            content += f"\n\n=== 文件: {os.path.basename(filepath)} ===\n"
+            content += read_file_content(filepath)
+        contents = [content]
+    return latest_folder, contents
+
+def report_path_for(folder):
+    """分析文件夹对应的报告路径: 项目根目录的"ai视频识别报告"文件夹/视频名_ai_report.txt"""
     ai_report_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai视频识别报告")
     os.makedirs(ai_report_dir, exist_ok=True)
     
-    folder_name = os.path.basename(latest_folder)  # 获取分析文件夹名称
-    report_filename = f"{folder_name}_ai_report.txt"
-    report_path = os.path.join(ai_report_dir, report_filename)
+    folder_name = os.path.basename(folder)  # 获取分析文件夹名称
+    return os.path.join(ai_report_dir, f"{folder_name}_ai_report.txt")
+
+def save_report(folder, analysis_result):
+    """把大模型结果写入报告文件，返回报告路径"""
+    report_path = report_path_for(folder)
     
     with open(report_path, 'w', encoding='utf-8') as f:
         f.write(analysis_result)
     
     print(f"分析报告已生成: {report_path}")
+    return report_path
+
+def generate_report(folder=None, on_row=None):
+    """生成分析报告，返回报告路径
+
+    on_row(row)在每个表格行完成时调用，下游可以不等整份报告生成就开始处理
+    """
+    config = load_config()
+    prepared = prepare_report(config, folder)
+    if prepared is None:
+        return
+    folder, contents = prepared
+    if len(contents) > 1:
+        # 分段内容通过调度器并行请求，耗时取决于最慢的一段；合并后才能确定行的顺序
+        dispatcher = load_dispatcher(config)
+        try:
+            report_path = submit_report(folder, dispatcher, config, prepared=prepared).result()
+        finally:
+            dispatcher.close()
+        if on_row and report_path:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                write_stream([f.read()], on_row=on_row, echo=False)
+        return report_path
+    
+    # 3. 调用DeepSeek处理，结果边生成边写入报告文件
+    print("正在使用ai大模型处理内容...")
+    report_path = report_path_for(folder)
+    meter = load_usage_meter(config)
+    process_with_deepseek(config, contents[0], output_path=report_path, on_row=on_row,
+                          usage=meter.recorder('report', os.path.basename(folder)) if meter else None)
+    print(f"分析报告已生成: {report_path}")
+    return report_path
+
+def submit_report(folder, dispatcher, config=None, prepared=None):
+    """通过LlmDispatcher异步生成报告，立即返回Future，完成后结果为报告路径(失败时为None)
+
+    内容分段时各段同时提交，全部完成后按顺序合并为一份报告；
+    不分段且开启stream时，回复边生成边写入报告文件
+    """
+    config = config or load_config()
+    result = Future()
+    prepared = prepared or prepare_report(config, folder)
+    if prepared is None:
+        result.set_result(None)
+        return result
+    folder, contents = prepared
+    print(f"已提交 {os.path.basename(folder)} 的报告生成请求({len(contents)} 段)")
+    model = config['ai_auto_processor']['model']
+    meter = load_usage_meter(config)
+    recorder = meter.recorder('report', os.path.basename(folder)) if meter else None
+    # 分段的结果要合并后才能确定行的顺序，只有单段请求直接流式写入报告
+    stream = len(contents) == 1 and config['ai_auto_processor'].get('stream', True)
+    output_path = report_path_for(folder) if stream else None
+    requests = [dispatcher.submit(model, build_messages(config, content), recorder=recorder, output_path=output_path)
+                for content in contents]
+    remaining = [len(requests)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            result.set_result(save_report(folder, merge_chunk_results([r.result() for r in requests])))
+        except Exception as e:
+            result.set_exception(e)
+
+    for request in requests:
+        request.add_done_callback(on_done)
+    return result
 
 if __name__ == "__main__":
     config = load_config()
     generate_report()
+    print_cache_stats(config)
+    meter = load_usage_meter(config)
+    if meter is not None:
+        meter.write_summary()
@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+
+JOURNAL_FILENAME = 'analysis_journal.jsonl'
+
+def make_fingerprint(video_path, **params):
+    """由视频文件(路径、大小、修改时间)和分析参数生成指纹，任一变化时旧检查点作废"""
+    stat = os.stat(video_path)
+    payload = json.dumps({
+        'video': os.path.abspath(video_path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'params': params
+    }, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def group_key(group):
+    """关键帧组的标识: 组内各帧的时间戳(毫秒)"""
+    return [int(round((frame.get('pts') or 0) * 1000)) for frame in group['frames']]
+
+class AnalysisJournal:
+    """关键帧组检查点日志(output/视频名/analysis_journal.jsonl)
+
+    每完成一组追加一行并fsync，崩溃最多丢失正在写入的一行；
+    重新分析同一视频时读取已完成的组，这些组不再请求模型。
+    首行记录指纹，视频或分析参数变化后整个日志作废重建
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.completed = {}
+        if os.path.exists(path) and not self._load():
+            print(f"\n视频或分析参数已变化，丢弃旧检查点: {path}")
+            os.remove(path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        is_new = not os.path.exists(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        if is_new:
+            self._write({'type': 'header', 'fingerprint': fingerprint})
+        elif self.completed:
+            print(f"\n从检查点恢复: 已完成 {len(self.completed)} 组")
+
+    def _load(self):
+        """读取已完成的组，指纹不符时返回False"""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # 崩溃时写到一半的行
+                continue
+        if not records or records[0].get('type') != 'header' or records[0].get('fingerprint') != self.fingerprint:
+            return False
+        for record in records[1:]:
+            if record.get('type') == 'group':
+                self.completed[record['group']] = record
+        return True
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def lookup(self, group_idx, group):
+        """返回已完成组的描述；组内帧与记录不一致时返回None"""
+        record = self.completed.get(group_idx)
+        if record is not None and record['frames'] == group_key(group):
+            return record['desc']
+        return None
+
+    def append(self, group_idx, group, desc):
+        """记录一个已完成的组"""
+        record = {
+            'type': 'group',
+            'group': group_idx,
+            'start': group['start'],
+            'end': group['end'],
+            'frames': group_key(group),
+            'desc': desc
+        }
+        self._write(record)
+        self.completed[group_idx] = record
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self):
+        """报告完成后删除检查点"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
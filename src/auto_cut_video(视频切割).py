@@ -1,16 +1,28 @@
 import re
 import os
+import queue
+import threading
 import subprocess
 from pathlib import Path
+import media_probe
+
+# 脚本表格行中的素材位置: 第1集 00:00.31~00:02.31
+CLIP_PATTERN = re.compile(r'第(\d+)集 (\d+:\d+\.\d+)~(\d+:\d+\.\d+)')
 
 def parse_time(time_str):
     """将mm:ss.ms格式转换为HH:MM:SS.ms格式"""
     mm_ss, ms = time_str.split('.')
     return f"00:{mm_ss}.{ms}"
 
+def parse_clip_row(line):
+    """从一行脚本表格中提取(集数, 开始, 结束)，不是素材行时返回None"""
+    match = CLIP_PATTERN.search(line)
+    if not match:
+        return None
+    return int(match.group(1)), match.group(2), match.group(3)
+
 def parse_markdown(md_file):
     """解析Markdown文件，提取剪辑信息"""
-    pattern = re.compile(r'第(\d+)集 (\d+:\d+\.\d+)~(\d+:\d+\.\d+)')
     clips = []
     in_table = False
     
@@ -23,12 +35,9 @@ def parse_markdown(md_file):
                 continue
                 
             # 匹配表格行中的时间码
-            match = pattern.search(line)
-            if match:
-                ep_num = int(match.group(1))
-                start_time = match.group(2)
-                end_time = match.group(3)
-                clips.append((ep_num, start_time, end_time))
+            clip = parse_clip_row(line)
+            if clip:
+                clips.append(clip)
     return clips
 
 def find_video_file(episode):
@@ -55,38 +64,22 @@ def generate_output_filename(index, ep_num, start, end, description):
 
 def get_frame_rate(video_file):
     """获取视频帧率"""
-    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
-           '-show_entries', 'stream=r_frame_rate', '-of', 'csv=p=0', video_file]
-    result = subprocess.run(cmd, text=True)
-    return float(eval(result.stdout.strip()))  # 处理分数形式的帧率
+    return media_probe.get_frame_rate(video_file)
 
 def find_nearest_keyframe(video_file, timestamp):
     """查找最近的关键帧(优先向后偏移)"""
     MAX_OFFSET = 1.0  # 最大允许偏差1秒
-    cmd = [
-        'ffprobe', '-read_intervals', f'{max(0,timestamp-1)}%+2',
-        '-show_frames', '-select_streams', 'v',
-        '-print_format', 'csv', '-show_entries', 'frame=key_frame,pkt_pts_time',
-        video_file
-    ]
-    result = subprocess.run(cmd, stderr=subprocess.DEVNULL, text=True)
-    
-    # 获取所有关键帧时间点
-    keyframes = [float(line.split(',')[1]) for line in result.stdout.splitlines()
-               if line.startswith('frame,') and line.split(',')[0] == '1']
-    
-    if not keyframes:
-        return timestamp
+    before, after = media_probe.nearest_keyframes(video_file, timestamp)
     
     # 优先选择后面的关键帧
-    later_frames = [kf for kf in keyframes if kf >= timestamp]
-    if later_frames:
-        nearest = min(later_frames, key=lambda x: abs(x - timestamp))
-        if abs(nearest - timestamp) <= MAX_OFFSET:
-            return nearest
+    if after is not None and after - timestamp <= MAX_OFFSET:
+        return after
     
     # 如果没有合适的后向关键帧，选择最接近的
-    nearest = min(keyframes, key=lambda x: abs(x - timestamp))
+    candidates = [kf for kf in (before, after) if kf is not None]
+    if not candidates:
+        return timestamp
+    nearest = min(candidates, key=lambda x: abs(x - timestamp))
     return nearest if abs(nearest - timestamp) <= MAX_OFFSET else timestamp
 
 def cut_video_copy(input_file, output_file, start, end):
@@ -108,9 +101,6 @@ def check_gpu_support():
                             capture_output=True, text=True)
     return 'h264_nvenc' in result.stdout or 'h264_amf' in result.stdout
 
-def cut_video_reencode(input_file, output_file, start, end):
-    """处理10-bit视频的AMD加速方案"""
-    if check_gpu_support():
 def cut_video_reencode(input_file, output_file, start, end):
     """处理10-bit视频的AMD加速方案"""
     if check_gpu_support():
@@ -178,6 +168,67 @@ def cut_video(input_file, output_file, start, end):
     print("使用渲染模式 (强制所有片段精确切割)")
     cut_video_reencode(input_file, output_file, start, end)
 
+def cut_clip(index, clip, output_dir):
+    """切出脚本中的第index个片段，找不到视频文件时返回None"""
+    ep_num, start, end = clip
+    video_file = find_video_file(ep_num)
+    if not video_file:
+        print(f"未找到第{ep_num}集视频文件")
+        return None
+    
+    # 简单使用序号作为描述（实际可从Markdown提取）
+    output_file = Path(output_dir) / generate_output_filename(
+        index, ep_num, start, end, f"clip_{index}")
+        
+    print(f"处理片段{index}: 第{ep_num}集 {start}-{end}")
+    cut_video(video_file, output_file, start, end)
+    print(f"已保存到: {output_file}")
+    return output_file
+
+class ClipCutter:
+    """边生成剪辑脚本边切割
+
+    每收到一个完整的脚本表格行就交给后台线程切出对应片段，
+    不必等整份脚本生成完；开始前清空该项目上一次的片段
+    """
+
+    def __init__(self, project_name="mad_script"):
+        self.output_dir = Path("ai切割素材") / project_name
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        for old_clip in self.output_dir.glob("*.mp4"):
+            old_clip.unlink()
+        self.count = 0
+        self.failed = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def add_row(self, row):
+        """接收一个脚本表格行，是素材行时排队切割"""
+        clip = parse_clip_row(row)
+        if clip is None:
+            return
+        self.count += 1
+        self._queue.put((self.count, clip))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            index, clip = item
+            try:
+                cut_clip(index, clip, self.output_dir)
+            except Exception as e:
+                print(f"片段{index}切割失败: {e}")
+                self.failed.append(index)
+
+    def wait(self):
+        """等待已排队的片段切割完成"""
+        self._queue.put(None)
+        self._thread.join()
+        print(f"\n已切割 {self.count - len(self.failed)}/{self.count} 个片段到: {self.output_dir}")
+
 def main():
     # 扫描ai剪辑脚本目录下的所有md文件
     md_dir = Path("ai剪辑脚本")
@@ -195,19 +246,8 @@ def main():
         output_dir.mkdir(parents=True, exist_ok=True)
         
         clips = parse_markdown(str(md_file))
-        for i, (ep_num, start, end) in enumerate(clips, 1):
-            video_file = find_video_file(ep_num)
-            if not video_file:
-                print(f"未找到第{ep_num}集视频文件")
-                continue
-            
-            # 简单使用序号作为描述（实际可从Markdown提取）
-            output_file = output_dir / generate_output_filename(
-                i, ep_num, start, end, f"clip_{i}")
-                
-            print(f"处理片段{i}: 第{ep_num}集 {start}-{end}")
-            cut_video(video_file, output_file, start, end)
-            print(f"已保存到: {output_file}")
+        for i, clip in enumerate(clips, 1):
+            cut_clip(i, clip, output_dir)
 
 if __name__ == "__main__":
     main()
@@ -4,59 +4,121 @@ import shutil
 import glob
 import subprocess
 import json
+import threading
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 
 from difflib import SequenceMatcher
 
-def find_matching_subtitle(video_file, subtitle_dir):
-    """智能匹配最佳字幕文件"""
-    # 提取视频文件关键信息
-    video_name = os.path.splitext(video_file)[0]
-    ep_num = re.search(r'\[(\d{2})\]', video_name)
-    ep_num = ep_num.group(1) if ep_num else None
-    
-    # 获取所有候选字幕文件
-    candidates = [f for f in os.listdir(subtitle_dir) 
-                if f.endswith('.ass')]
-    
+import vlm_router
+import ai_auto_processor
+from frame_cache import load_frame_cache
+from llm_dispatcher import load_dispatcher
+from llm_cache import print_cache_stats
+from usage_meter import load_usage_meter
+
+# 集数标记: [01]、第01集/话、EP01、E01、" - 01 "
+EPISODE_PATTERNS = [
+    re.compile(r'\[(\d{1,3})(?:v\d)?\]'),
+    re.compile(r'第\s*(\d{1,3})\s*[集话話]'),
+    re.compile(r'\bE[Pp]?\s*(\d{1,3})\b', re.IGNORECASE),
+    re.compile(r'\s-\s(\d{1,3})(?:v\d)?(?:\s|$)'),
+]
+# 字幕文件名中的语言标记，如.scjp.ass、.chs.ass
+SUBTITLE_LANG_SUFFIX = re.compile(r'(\.(?:scjp|tcjp|sc|tc|chs|cht|jp|jpn|zh|gb|big5))+$', re.IGNORECASE)
+# 相似度匹配时标题(normalize_title)的最低相似度，低于该值视为其他作品的字幕
+MIN_TITLE_SIMILARITY = 0.6
+
+def extract_episode(name):
+    """从文件名(去掉扩展名和语言标记)中提取集数，找不到时返回None"""
+    stem = SUBTITLE_LANG_SUFFIX.sub('', os.path.splitext(name)[0])
+    for pattern in EPISODE_PATTERNS:
+        match = pattern.search(stem)
+        if match:
+            return int(match.group(1))
+    return None
+
+def normalize_title(name):
+    """去掉扩展名、语言标记、括号内容和集数后的标题，用于精确匹配和相似度比较"""
+    stem = os.path.splitext(name)[0]
+    stem = SUBTITLE_LANG_SUFFIX.sub('', stem)
+    stem = re.sub(r'\[.*?\]|【.*?】|\(.*?\)|（.*?）', ' ', stem)
+    stem = re.sub(r'第\s*\d+\s*[集话話]|\bE[Pp]?\s*\d+\b|\s-\s\d+(?:v\d)?\b', ' ', stem, flags=re.IGNORECASE)
+    return re.sub(r'[\W_]+', '', stem).lower()
+
+def build_subtitle_index(subtitle_dir):
+    """扫描一次字幕目录，按集数和(集数, 标题)建立索引"""
+    index = {'dir': subtitle_dir, 'by_episode': {}, 'by_key': {}, 'all': []}
+    for sub in sorted(os.listdir(subtitle_dir)):
+        if not sub.endswith('.ass'):
+            continue
+        entry = {'name': sub, 'episode': extract_episode(sub), 'title': normalize_title(sub)}
+        index['all'].append(entry)
+        index['by_episode'].setdefault(entry['episode'], []).append(entry)
+        index['by_key'].setdefault((entry['episode'], entry['title']), []).append(entry)
+    return index
+
+def title_similarity(video_title, entry):
+    return SequenceMatcher(None, video_title, entry['title']).ratio()
+
+def score_subtitle(video_title, entry):
+    """候选字幕的相似度分数: 名称相似度(30分) + 简日双语字幕(20分)"""
+    score = int(30 * title_similarity(video_title, entry))
+    if '.scjp.ass' in entry['name']:
+        score += 20
+    return score
+
+def match_subtitle(video_file, index):
+    """在字幕索引中查找视频对应的字幕
+
+    先按(集数, 标题)精确查找；没有时只在同集数的候选中做相似度匹配，没有同集数字幕时返回None；
+    文件名中没有集数时，才在全部字幕中做相似度匹配；
+    相似度匹配的标题相似度低于MIN_TITLE_SIMILARITY时返回None，不使用其他作品的同集数字幕
+    """
+    episode = extract_episode(video_file)
+    title = normalize_title(video_file)
+    candidates = index['by_key'].get((episode, title))
+    method = '精确'
+    if not candidates and episode is not None:
+        candidates = index['by_episode'].get(episode)
+        method = '同集数相似度'
+    elif not candidates:
+        candidates = index['all']
+        method = '全部相似度'
     if not candidates:
-        print(f"未找到任何候选字幕文件")
         return None
-    
-    # 计算每个候选文件的匹配分数
-    scores = []
-    for sub in candidates:
-        score = 0
-        
-        # 集数匹配(50分)
-        if ep_num and f"[{ep_num}]" in sub:
-            score += 50
-        
-        # 名称相似度(30分)
-        video_key = re.sub(r'\[.*?\]', '', video_name).strip().lower()
-        sub_key = re.sub(r'\[.*?\]', '', sub).strip().lower()
-        score += int(30 * SequenceMatcher(
-            None, video_key, sub_key).ratio())
-        
-        # 扩展名匹配(20分)
-        if '.scjp.ass' in sub:
-            score += 20
-            
-        scores.append(score)
-        print(f"字幕 '{sub}' 匹配分数: {score}")  # 调试输出
-    
-    # 返回最佳匹配
-    best_idx = scores.index(max(scores))
-    best_match = candidates[best_idx]
-    print(f"选择最佳匹配字幕: {best_match} (分数: {max(scores)})")
-    return os.path.join(subtitle_dir, best_match)
+    best = max(candidates, key=lambda entry: score_subtitle(title, entry))
+    if method != '精确' and title_similarity(title, best) < MIN_TITLE_SIMILARITY:
+        print(f"警告: {video_file} 与最接近的字幕 {best['name']} 标题相似度过低，视为未匹配")
+        return None
+    if method == '全部相似度':
+        print(f"警告: 无法从 {video_file} 中识别集数，按名称相似度选择: {best['name']}")
+    return os.path.join(index['dir'], best['name']), method
+
+def resolve_subtitles(video_files, subtitle_dir):
+    """一次性为所有视频匹配字幕，返回{视频文件名: 字幕路径或None}"""
+    index = build_subtitle_index(subtitle_dir)
+    if not index['all']:
+        print(f"未找到任何候选字幕文件")
+    pairs = {}
+    for video in video_files:
+        match = match_subtitle(video, index) if index['all'] else None
+        pairs[video] = match[0] if match else None
+        if match:
+            print(f"{video} -> {os.path.basename(match[0])} ({match[1]})")
+    return pairs
+
+def find_matching_subtitle(video_file, subtitle_dir):
+    """智能匹配最佳字幕文件"""
+    return resolve_subtitles([video_file], subtitle_dir)[video_file]
 
-def check_analysis_success(video_filename):
+def check_analysis_success(video_filename, report_path=None):
     """检查是否生成分析文档"""
-    # 移除视频文件扩展名
-    base_name = os.path.splitext(video_filename)[0]
-    report_path = os.path.join('ai视频识别报告', f"{base_name}_ai_report.txt")
+    if report_path is None:
+        # 移除视频文件扩展名
+        base_name = os.path.splitext(video_filename)[0]
+        report_path = os.path.join('ai视频识别报告', f"{base_name}_ai_report.txt")
     print(f"正在检查报告文件: {report_path}")
     if os.path.exists(report_path):
         size = os.path.getsize(report_path)
@@ -72,9 +134,13 @@ def init_log(batch_id):
     return log_path
 
 def save_log(log_path, data):
-    """保存日志"""
-    with open(log_path, 'w', encoding='utf-8') as f:
+    """保存日志(先写临时文件再替换，中途断电不会留下损坏的日志)"""
+    tmp_path = log_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, log_path)
 
 def load_log(log_path):
     """加载日志"""
@@ -92,13 +158,105 @@ def clean_temp_frames():
         os.rmdir(temp_dir)
         print(f"已清理残留临时目录: {temp_dir}")
 
-def process_batch(video_dir, subtitle_dir, output_dir, batch_size=1, log_path=None):
-    """处理一批视频文件"""
+STAGING_MODES = ('reference', 'link', 'copy')
+
+def stage_file(source, target, mode='link'):
+    """把源文件放入工作区，返回实际使用的方式
+
+    reference: 不放入工作区，直接使用源路径
+    link:      依次尝试硬链接、符号链接，跨文件系统或无权限时才复制
+    copy:      完整复制
+    """
+    if mode == 'reference':
+        return source, 'reference'
+    if mode == 'link':
+        try:
+            os.link(source, target)
+            return target, 'hardlink'
+        except OSError:
+            pass
+        try:
+            os.symlink(os.path.abspath(source), target)
+            return target, 'symlink'
+        except OSError:
+            pass
+    elif mode != 'copy':
+        raise ValueError(f"未知的暂存方式: {mode}，可选: {', '.join(STAGING_MODES)}")
+    shutil.copy2(source, target)
+    return target, 'copy'
+
+def prepare_workspace(workspace_root, video):
+    """为一集创建独立工作区: 工作区/视频名/video_input 和 temp_frames"""
+    workspace = os.path.join(workspace_root, os.path.splitext(video)[0])
+    if os.path.exists(workspace):
+        # 清理上次中断残留的文件
+        shutil.rmtree(workspace)
+    os.makedirs(os.path.join(workspace, 'video_input'))
+    return workspace
+
+def run_episode(video_path, subtitle_path, workspace_root, settings, cache=None, session=None, staging='link',
+                ai_report=True, meter=None):
+    """在独立工作区中分析一集并生成AI报告，所有路径显式传给各阶段
+
+    ai_report为False时只做关键帧分析，返回分析报告是否生成
+    """
+    import video_analyzer
+
+    video = os.path.basename(video_path)
+    workspace = prepare_workspace(workspace_root, video)
+    try:
+        # 1. 把视频和字幕放入本集工作区(默认链接，不复制视频数据)
+        input_dir = os.path.join(workspace, 'video_input')
+        staged_video, video_method = stage_file(video_path, os.path.join(input_dir, video), staging)
+        staged_subtitle, _ = stage_file(subtitle_path, os.path.join(input_dir, os.path.basename(subtitle_path)),
+                                        staging)
+        print(f"[{video}] 已放入工作区({video_method}): {workspace}")
+
+        # 2. 执行视频分析
+        report_path = video_analyzer.analyze_video(
+            staged_video,
+            os.path.join(workspace, 'temp_frames'),
+            subtitle_path=staged_subtitle,
+            cache=cache,
+            session=session,
+            meter=meter,
+            **settings
+        )
+
+        # 3. 生成AI报告
+        if not ai_report:
+            return os.path.exists(report_path)
+        ai_report_path = ai_auto_processor.generate_report(os.path.dirname(report_path))
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    return check_analysis_success(video, ai_report_path)
+
+def load_batch_settings():
+    """读取分析参数和并行集数"""
+    import video_analyzer
+
+    config = {}
+    if os.path.exists('src/config.json'):
+        with open('src/config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    batch_config = config.get('batch_processing', {})
+    workers = max(1, batch_config.get('workers', 1))
+    return config, video_analyzer.load_settings(config), workers, batch_config.get('staging', 'link')
+
+def process_batch(video_dir, subtitle_dir, workspace_root, workers=None, log_path=None, videos=None, ai_report=True):
+    """并行处理一批视频文件
+
+    每集在workspace_root下的独立工作区中运行，workers集同时进行；
+    共用一个模型路由和描述缓存，总并发请求数为 workers × max_concurrent_frames；
+    videos限定只处理其中的视频文件名，ai_report为False时只做关键帧分析
+    """
     print(f"视频目录: {video_dir}")
     print(f"字幕目录: {subtitle_dir}")
-    print(f"输出目录: {output_dir}")
+    print(f"工作区目录: {workspace_root}")
     
     video_files = sorted([f for f in os.listdir(video_dir) if f.endswith('.mkv')])
+    if videos is not None:
+        video_files = [f for f in video_files if f in videos]
     print(f"找到视频文件: {video_files}")
 
     # 初始化日志数据
@@ -111,83 +269,109 @@ def process_batch(video_dir, subtitle_dir, output_dir, batch_size=1, log_path=No
     if log_path and os.path.exists(log_path):
         log_data = load_log(log_path)
         print(f"从日志恢复处理: {log_path}")
+    log_lock = threading.Lock()
 
-    for i in range(0, len(video_files), batch_size):
-        batch = video_files[i:i+batch_size]
-        
-        for video in batch:
-            # 检查是否已处理过
-            processed = next((v for v in log_data['videos'] if v['filename'] == video), None)
-            if processed and processed['status'] == 'completed':
-                print(f"跳过已处理的视频: {video}")
-                continue
-                
-            # 清空输出目录
-            for f in os.listdir(output_dir):
-                os.remove(os.path.join(output_dir, f))
-            
-            # 清理临时文件
-            clean_temp_frames()
-            
-            # 更新日志状态为处理中
-            video_log = {
-                'filename': video,
-                'status': 'processing',
-                'start_time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'end_time': None,
-                'error': None
-            }
-            if not processed:
+    def update_log(video, **fields):
+        with log_lock:
+            video_log = next((v for v in log_data['videos'] if v['filename'] == video), None)
+            if video_log is None:
+                video_log = {'filename': video, 'status': None, 'start_time': None, 'end_time': None, 'error': None}
                 log_data['videos'].append(video_log)
-            else:
-                processed.update(video_log)
-            save_log(log_path, log_data)
-                
-            video_path = os.path.join(video_dir, video)
-            subtitle_path = find_matching_subtitle(video, subtitle_dir)
-            
-            if subtitle_path:
-                # 1. 拷贝文件到处理目录
-                shutil.copy2(video_path, output_dir)
-                shutil.copy2(subtitle_path, output_dir)
-                print(f"已拷贝: {video} 和匹配的字幕")
-            
-                # 2. 执行视频分析
-                print("正在执行video_analyzer.py...")
-                import video_analyzer
-                video_analyzer.main()
-                
-                # 3. 检查分析结果
-                if check_analysis_success(video):
-                    print(f"视频 {video} 分析完成，清理输入目录")
-                    for f in os.listdir(output_dir):
-                        os.remove(os.path.join(output_dir, f))
-                        
-                    # 更新日志状态为完成
-                    video_log['status'] = 'completed'
-                    video_log['end_time'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    save_log(log_path, log_data)
-                else:
-                    print(f"警告: 视频 {video} 分析文档未生成")
-                    video_log['status'] = 'failed'
-                    video_log['error'] = '分析文档未生成'
-                    save_log(log_path, log_data)
-                    return False
-                clean_temp_frames()
-            else:
-                print(f"警告: 未找到 {video} 的字幕文件")
-                return False
+            video_log.update(fields)
+            if log_path:
+                save_log(log_path, log_data)
+
+    # 先确定所有待处理的集，再一次性匹配字幕
+    pending = []
+    for video in video_files:
+        processed = next((v for v in log_data['videos'] if v['filename'] == video), None)
+        if processed and processed['status'] == 'completed':
+            print(f"跳过已处理的视频: {video}")
+            continue
+        pending.append(video)
+    subtitles = resolve_subtitles(pending, subtitle_dir)
+
+    jobs = []
+    success = True
+    for video in pending:
+        subtitle_path = subtitles[video]
+        if not subtitle_path:
+            print(f"警告: 未找到 {video} 的字幕文件")
+            update_log(video, status='failed', error='未找到字幕文件')
+            success = False
+            continue
+        jobs.append((video, subtitle_path))
+    if not jobs:
+        return success
+
+    config, settings, configured_workers, staging = load_batch_settings()
+    workers = min(workers or configured_workers, len(jobs))
+    os.makedirs(workspace_root, exist_ok=True)
+    cache = load_frame_cache(config)
+    meter = load_usage_meter(config)
+    session = vlm_router.load_router(config, settings['max_concurrent'] * workers)
+    print(f"共 {len(jobs)} 集待处理，并行 {workers} 集")
+
+    # AI报告交给异步调度器，工作线程提交后立即开始分析下一集
+    dispatcher = load_dispatcher(config) if ai_report else None
+
+    def run(video, subtitle_path):
+        update_log(video, status='processing', start_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                   end_time=None, error=None)
+        analyzed = run_episode(os.path.join(video_dir, video), subtitle_path, workspace_root, settings,
+                               cache=cache, session=session, staging=staging, ai_report=False, meter=meter)
+        if not analyzed or not ai_report:
+            return analyzed
+        folder = os.path.join('output', os.path.splitext(video)[0])
+        return ai_auto_processor.submit_report(folder, dispatcher, config)
+
+    def finish(video, future, check):
+        nonlocal success
+        end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            completed = check(future.result())
+        except Exception as e:
+            print(f"\n错误: 视频 {video} 处理失败: {e}")
+            update_log(video, status='failed', end_time=end_time, error=str(e))
+            success = False
+            return
+        if completed:
+            print(f"\n视频 {video} 分析完成")
+            update_log(video, status='completed', end_time=end_time)
+        else:
+            print(f"\n警告: 视频 {video} 分析文档未生成")
+            update_log(video, status='failed', end_time=end_time, error='分析文档未生成')
+            success = False
+
+    report_futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, video, subtitle_path): video for video, subtitle_path in jobs}
+        for future in as_completed(futures):
+            video = futures[future]
+            if not future.exception() and isinstance(future.result(), Future):
+                report_futures[future.result()] = video
+                continue
+            finish(video, future, bool)
+
+    for future in as_completed(report_futures):
+        video = report_futures[future]
+        finish(video, future, lambda path: bool(path) and check_analysis_success(video, path))
+    if dispatcher is not None:
+        stats = dispatcher.stats
+        print(f"\n大模型请求: {stats['requests']} 次, 缓存命中 {stats['cache_hits']} 次, 重试 {stats['retries']} 次, "
+              f"失败 {stats['failures']} 次, 输入 {stats['prompt_tokens']} tokens, 输出 {stats['completion_tokens']} tokens")
+        dispatcher.close()
+    print_cache_stats(config)
+    if meter is not None:
+        meter.write_summary()
                 
-    return True
+    return success
 
 if __name__ == "__main__":
     # 配置路径
     VIDEO_DIR = os.path.join('input', '视频批处理', '视频')
     SUBTITLE_DIR = os.path.join('input', '视频批处理', '字幕') 
-    OUTPUT_DIR = os.path.join('input', 'video_input')
-    
-    # 创建输出目录(如果不存在)
-    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    WORKSPACE_DIR = os.path.join('input', '视频批处理', '工作区')
     
     # 清理可能残留的临时文件
     clean_temp_frames()
@@ -199,12 +383,11 @@ if __name__ == "__main__":
     # 检查是否有未完成的日志
     latest_log = max(glob.glob(os.path.join('input', '视频批处理', '批处理日志', 'batch_*.json')), default=None)
     
-    # 每次处理1个视频(可调整batch_size)
+    # 并行集数由config.json的batch_processing.workers决定
     success = process_batch(
         VIDEO_DIR, 
         SUBTITLE_DIR, 
-        OUTPUT_DIR, 
-        batch_size=1,
+        WORKSPACE_DIR, 
         log_path=latest_log if latest_log else log_path
     )
     
@@ -29,9 +29,10 @@ def main():
     print("3. input/video_input")
     print("4. 最终输出视频")
     print("5. ai切割素材")
-    print("6. 全部清理")
+    print("6. cache(关键帧描述、大模型回复、媒体信息和字幕解析缓存)")
+    print("7. 全部清理")
     
-    choice = input("请输入选项(1/2/3/4/5/6): ").strip()
+    choice = input("请输入选项(1/2/3/4/5/6/7): ").strip()
     
     targets = []
     if choice == '1':
@@ -45,7 +46,9 @@ def main():
     elif choice == '5':
         targets.append('ai切割素材')
     elif choice == '6':
-        targets.extend(['ai视频识别报告', 'output', 'input/video_input', '最终输出视频', 'ai切割素材'])
+        targets.append('cache')
+    elif choice == '7':
+        targets.extend(['ai视频识别报告', 'output', 'input/video_input', '最终输出视频', 'ai切割素材', 'cache'])
     else:
         print("无效选项，程序退出")
         return
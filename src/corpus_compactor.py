@@ -0,0 +1,233 @@
+import os
+import re
+import argparse
+
+from llm_dispatcher import estimate_tokens
+from llm_stream import TABLE_SEPARATOR
+
+# 按文件名识别AI报告(单集报告或合并后的报告)，其余文件只去掉表格排版
+REPORT_NAMES = re.compile(r'(_ai_report|combined_reports)', re.IGNORECASE)
+
+# 集数标记: [01]、第01集/话、01集
+EPISODE_MARKERS = [
+    re.compile(r'\[(\d{1,3})\]'),
+    re.compile(r'第\s*(\d{1,3})\s*[集话話]'),
+    re.compile(r'(\d{1,3})\s*集'),
+]
+
+TIMECODE = re.compile(r'\d{1,2}(?::\d{1,2}){1,2}(?:\.\d+)?')
+
+# 超出预算时逐级压缩: (画面描述最多字数, 核心内容最多字数)，None为不截断，0为省略
+LEVELS = [(None, None), (24, None), (12, None), (0, None), (0, 20), (0, 12)]
+
+# 短于该字数的描述不做"=编号"引用，引用本身不比原文短
+MIN_REFERENCE_LENGTH = 8
+
+def table_rows(text):
+    """取出Markdown表格的数据行(表头分隔行之后)，每行为单元格列表"""
+    rows = []
+    in_table = False
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith('|'):
+            in_table = False
+            continue
+        if TABLE_SEPARATOR.match(line):
+            in_table = True
+            continue
+        if in_table:
+            rows.append([cell.strip() for cell in line.strip('|').split('|')])
+    return rows
+
+def split_sections(text, default_title):
+    """按"## 标题"切分合并报告，返回[(标题, 内容)]；没有标题的文件整体作为一节"""
+    sections = []
+    title, lines = default_title, []
+    for line in text.splitlines():
+        if line.startswith('## '):
+            if any(l.strip() for l in lines):
+                sections.append((title, '\n'.join(lines)))
+            title, lines = line[3:].strip(), []
+        else:
+            lines.append(line)
+    if any(l.strip() for l in lines):
+        sections.append((title, '\n'.join(lines)))
+    return sections
+
+def to_seconds(value):
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def format_mmss(seconds):
+    """统一为分:秒(超过一小时时分钟数大于59)"""
+    minutes, secs = divmod(int(round(seconds)), 60)
+    return f"{minutes:02d}:{secs:02d}"
+
+def clean_title(title):
+    """去掉报告标题中的压制组/集数/规格标记和_ai_report后缀"""
+    title = re.sub(r'_ai_report$', '', title)
+    title = re.sub(r'\[[^\]]*\]|【[^】]*】|\([^)]*\)', ' ', title)
+    return re.sub(r'\s+', ' ', title).strip()
+
+def find_episode(title, rows):
+    for pattern in EPISODE_MARKERS:
+        match = pattern.search(title)
+        if match:
+            return int(match.group(1))
+    # 标题中没有集数时使用"集数+时间码"列
+    for cells in rows[:3]:
+        if len(cells) >= 4:
+            match = EPISODE_MARKERS[2].search(cells[2])
+            if match:
+                return int(match.group(1))
+    return None
+
+def parse_shots(title, text, fallback_episode):
+    """把一集报告的表格行解析为镜头记录；模型的开场白等非表格内容丢弃"""
+    rows = table_rows(text)
+    episode = find_episode(title, rows) or fallback_episode
+    shots = []
+    for cells in rows:
+        times = TIMECODE.findall(cells[0])
+        if len(times) < 2 or len(cells) < 2:
+            continue
+        core = cells[1]
+        # 第三列"集数+时间码"与集数、开始时间重复，只保留最后一列画面描述
+        visual = cells[-1] if len(cells) >= 3 else ''
+        if visual == core or visual in core:
+            visual = ''
+        if shots and shots[-1]['core'] == core:
+            # 相邻的相同内容合并为一个镜头
+            shots[-1]['end'] = to_seconds(times[1])
+            continue
+        shots.append({
+            'episode': episode,
+            'start': to_seconds(times[0]),
+            'end': to_seconds(times[1]),
+            'core': core,
+            'visual': visual,
+            'title': clean_title(title)
+        })
+    for number, shot in enumerate(shots, 1):
+        shot['id'] = f"{episode}.{number}"
+    return shots
+
+def truncate(text, limit):
+    if limit is None or len(text) <= limit:
+        return text
+    return text[:limit] + '…' if limit else ''
+
+def render_shots(shots, level):
+    """按压缩级别输出紧凑文本: 每个镜头一行，重复的描述改为引用首次出现的镜头编号"""
+    visual_limit, core_limit = level
+    seen = {}
+    lines = ["每行一个镜头: 集.镜头号 开始-结束(分:秒) 核心内容｜画面；=编号 表示与该镜头描述相同"]
+    episode = title = None
+    for shot in shots:
+        if shot['episode'] != episode:
+            episode = shot['episode']
+            header = f"# 第{episode}集"
+            if shot['title'] != title:
+                title = shot['title']
+                header += f" {title}"
+            lines.append(header)
+        parts = []
+        for text, limit in ((shot['core'], core_limit), (shot['visual'], visual_limit)):
+            text = truncate(text, limit)
+            if len(text) >= MIN_REFERENCE_LENGTH and text in seen:
+                text = '=' + seen[text]
+            elif text:
+                seen.setdefault(text, shot['id'])
+            parts.append(text)
+        body = parts[0] + (f"｜{parts[1]}" if parts[1] else '')
+        lines.append(f"{shot['id']} {format_mmss(shot['start'])}-{format_mmss(shot['end'])} {body}")
+    return '\n'.join(lines)
+
+def compact_text(text):
+    """非报告文件只去掉表格排版: 删除分隔行、单元格两侧空白和空行"""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or TABLE_SEPARATOR.match(line) or line == '---':
+            continue
+        if line.startswith('|'):
+            line = '|'.join(cell.strip() for cell in line.strip('|').split('|'))
+        lines.append(line)
+    return '\n'.join(lines)
+
+def fit_budget(shots, budget):
+    """逐级压缩直到不超过budget(token)，最后一级仍超出时省略最短的镜头，返回(文本, 级别, 省略数)"""
+    for index, level in enumerate(LEVELS):
+        text = render_shots(shots, level)
+        if not budget or estimate_tokens(text) <= budget:
+            return text, index, 0
+    # 保留时长较长的镜头，省略后仍按时间顺序输出
+    ranked = sorted(range(len(shots)), key=lambda i: shots[i]['end'] - shots[i]['start'])
+    dropped = 0
+    while estimate_tokens(text) > budget and dropped < len(shots) - 1:
+        dropped = min(len(shots) - 1, dropped + max(1, len(shots) // 20))
+        removed = set(ranked[:dropped])
+        text = render_shots([s for i, s in enumerate(shots) if i not in removed], LEVELS[-1])
+    return text, len(LEVELS) - 1, dropped
+
+def compact_corpus(content_dir, token_budget=0):
+    """把ai分析数据目录压缩为紧凑文本，返回(文本, 统计)
+
+    AI报告改写为每镜头一行的规范格式(短编号、分:秒时间码、去掉表格排版和重复描述)，
+    其他文件(如音乐分析)只去掉表格排版；token_budget为0时不限制
+    """
+    original = ''
+    report_shots = []
+    others = []
+    file_count = 0
+    for filename in sorted(os.listdir(content_dir)):
+        filepath = os.path.join(content_dir, filename)
+        if not os.path.isfile(filepath) or filename.startswith('.'):
+            continue
+        with open(filepath, 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+        if not text:
+            continue
+        file_count += 1
+        original += text
+        if REPORT_NAMES.search(filename):
+            for title, section in split_sections(text, os.path.splitext(filename)[0]):
+                report_shots.extend(parse_shots(title, section, len({s['episode'] for s in report_shots}) + 1))
+        else:
+            others.append(f"=== 分析数据文件: {filename} ===\n{compact_text(text)}")
+
+    fixed = '\n\n'.join(others)
+    # 其他文件已占满预算时仍按最低预算压缩报告(0表示不限制)
+    budget = max(1, token_budget - estimate_tokens(fixed)) if token_budget else 0
+    level, dropped = 0, 0
+    parts = []
+    if report_shots:
+        reports, level, dropped = fit_budget(report_shots, budget)
+        parts.append(f"=== 视频内容分析(紧凑格式) ===\n{reports}")
+    if fixed:
+        parts.append(fixed)
+    content = '\n\n'.join(parts)
+    stats = {
+        'files': file_count,
+        'shots': len(report_shots) - dropped,
+        'dropped': dropped,
+        'level': level,
+        'original_tokens': estimate_tokens(original) if original else 0,
+        'tokens': estimate_tokens(content) if content else 0
+    }
+    return content, stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="预览ai分析数据压缩后的内容和token数")
+    parser.add_argument('--dir', default='ai分析数据', help="分析数据目录")
+    parser.add_argument('--budget', type=int, default=0, help="token预算(0为不限)")
+    parser.add_argument('--output', help="把压缩结果写入该文件")
+    args = parser.parse_args()
+    content, stats = compact_corpus(args.dir, args.budget)
+    print(f"{stats['files']} 个文件, {stats['shots']} 个镜头(省略 {stats['dropped']} 个), 压缩级别 {stats['level']}, "
+          f"约 {stats['original_tokens']} → {stats['tokens']} tokens")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
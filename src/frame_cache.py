@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+class FrameDescriptionCache:
+    """关键帧组描述的持久化缓存
+
+    键由图像内容哈希、模型名、提示词和推理参数共同决定，
+    超过max_entries时按最近使用时间淘汰(LRU)
+    """
+
+    def __init__(self, path='cache/frame_descriptions.sqlite3', max_entries=50000):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS descriptions ("
+            "key TEXT PRIMARY KEY, description TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON descriptions(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(images, model_name, prompt, options):
+        """根据图像内容和推理参数计算缓存键，图像可以是路径或字节"""
+        digest = hashlib.sha256()
+        for image in images:
+            if not isinstance(image, bytes):
+                with open(image, 'rb') as f:
+                    image = f.read()
+            digest.update(hashlib.sha256(image).digest())
+        params = json.dumps([model_name, prompt, options], ensure_ascii=False, sort_keys=True)
+        digest.update(params.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """读取缓存，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description FROM descriptions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE descriptions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, description):
+        """写入缓存并淘汰最久未使用的条目"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO descriptions (key, description, created, last_used) "
+                "VALUES (?, ?, ?, ?)", (key, description, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM descriptions WHERE key IN ("
+                    "SELECT key FROM descriptions ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def load_frame_cache(config):
+    """按config.json中的frame_cache配置创建缓存，未启用时返回None"""
+    cache_config = config.get('frame_cache', {})
+    if not cache_config.get('enabled', True):
+        return None
+    return FrameDescriptionCache(
+        path=cache_config.get('path', 'cache/frame_descriptions.sqlite3'),
+        max_entries=cache_config.get('max_entries', 50000)
+    )
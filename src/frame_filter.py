@@ -0,0 +1,80 @@
+import io
+import numpy as np
+from PIL import Image
+
+def frame_signature(image, thumb_size=64):
+    """计算帧的差值哈希(dHash)和亮度统计，image可以是路径或JPEG字节"""
+    source = io.BytesIO(image) if isinstance(image, bytes) else image
+    with Image.open(source) as img:
+        gray = img.convert('L')
+        # 9x8缩略图相邻像素比较得到64位哈希
+        hash_pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        luma = np.asarray(gray.resize((thumb_size, thumb_size), Image.BILINEAR), dtype=np.float32)
+    bits = (hash_pixels[:, 1:] > hash_pixels[:, :-1]).flatten()
+    dhash = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+    return dhash, float(luma.mean()), float(luma.std())
+
+def hamming_distance(a, b):
+    """两个哈希值的汉明距离"""
+    return bin(a ^ b).count('1')
+
+def filter_frames(frames, hash_distance=6, black_luma=16.0, flat_std=6.0, stats=None):
+    """剔除黑场/闪白/纯色帧并合并近似重复帧
+
+    被剔除的帧并入前一个保留帧(开头的并入第一个保留帧)，保留帧的
+    'covers'记录其覆盖的原始帧序号范围[起, 止]，'start'记录覆盖范围的起始时间，
+    保证报告时间轴不断档。为了在产出前确定覆盖范围，保留帧会延迟一帧产出
+    """
+    if stats is None:
+        stats = {}
+    stats.update({'total': 0, 'kept': 0, 'blank': 0, 'duplicate': 0})
+    pending = None       # 等待确定覆盖范围的保留帧
+    leading_from = None  # 第一个保留帧之前被剔除帧的起始序号
+    leading_start = None
+    first_frame = None
+    last_index = None
+
+    for frame in frames:
+        stats['total'] += 1
+        if first_frame is None:
+            first_frame = frame
+        last_index = frame['index']
+        dhash, mean, std = frame_signature(frame['image'])
+
+        # 黑场、闪白和字幕卡等几乎没有纹理的帧
+        if mean < black_luma or std < flat_std:
+            stats['blank'] += 1
+            if pending is not None:
+                pending['covers'][1] = frame['index']
+            elif leading_from is None:
+                leading_from = frame['index']
+                leading_start = frame.get('pts')
+            continue
+
+        if pending is not None and hamming_distance(dhash, pending['dhash']) <= hash_distance:
+            stats['duplicate'] += 1
+            pending['covers'][1] = frame['index']
+            continue
+
+        if pending is not None:
+            stats['kept'] += 1
+            yield pending
+        pending = frame
+        pending['dhash'] = dhash
+        if leading_from is None:
+            pending['covers'] = [frame['index'], frame['index']]
+            pending['start'] = frame.get('pts')
+        else:
+            pending['covers'] = [leading_from, frame['index']]
+            pending['start'] = leading_start
+            leading_from = None
+
+    if pending is None and first_frame is not None:
+        # 整段都被判定为空白时至少保留一帧
+        stats['blank'] -= 1
+        pending = first_frame
+        pending['covers'] = [first_frame['index'], last_index]
+        pending['start'] = first_frame.get('pts')
+    if pending is not None:
+        stats['kept'] += 1
+        yield pending
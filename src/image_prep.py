@@ -0,0 +1,128 @@
+import io
+import os
+import json
+import math
+import time
+import argparse
+from PIL import Image
+
+IMAGE_MODES = ('original', 'frames', 'tile')
+
+# 拼图模式下追加到提示词末尾，告诉模型画面顺序
+TILE_PROMPT_HINT = "（这些截图按从左到右、从上到下的顺序拼接在同一张图片中）"
+
+def open_image(image):
+    """打开路径或字节形式的图像"""
+    source = io.BytesIO(image) if isinstance(image, bytes) else image
+    img = Image.open(source)
+    img.load()
+    return img.convert('RGB')
+
+def fit_size(width, height, max_side):
+    """等比缩放到最长边不超过max_side"""
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def tile_images(images, padding=4):
+    """把一组图像按接近正方形的网格拼成一张联系表"""
+    cols = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / cols)
+    cell_w = max(img.width for img in images)
+    cell_h = max(img.height for img in images)
+    sheet = Image.new('RGB', (cols * cell_w + (cols - 1) * padding, rows * cell_h + (rows - 1) * padding))
+    for i, img in enumerate(images):
+        row, col = divmod(i, cols)
+        sheet.paste(img, (col * (cell_w + padding), row * (cell_h + padding)))
+    return sheet
+
+def shrink(img, max_side, quality):
+    """缩放到最长边不超过max_side并编码为JPEG"""
+    size = fit_size(img.width, img.height, max_side)
+    if size != img.size:
+        img = img.resize(size, Image.BICUBIC)
+    return encode_jpeg(img, quality)
+
+def image_size(image):
+    """只读取文件头获取路径或字节形式图像的尺寸，不解码像素"""
+    source = io.BytesIO(image) if isinstance(image, bytes) else image
+    with Image.open(source) as img:
+        return img.size
+
+def prepare_images(images, mode='original', max_side=448, quality=85):
+    """在内存中准备发送给视觉模型的图像，返回路径或JPEG字节列表
+
+    original: 原样发送(路径或字节)
+    frames:   最长边超过max_side的帧缩小到模型输入分辨率，其余原样发送。
+              keyframe_stream输出的帧宽度为360，max_side不小于360时只对更大的来源起作用
+    tile:     整组拼成一张联系表后缩放，每个请求只需编码一张图
+    """
+    if mode == 'original':
+        return list(images)
+    if mode not in IMAGE_MODES:
+        raise ValueError(f"未知的图像模式: {mode}，可选: {', '.join(IMAGE_MODES)}")
+    if mode == 'tile':
+        return [shrink(tile_images([open_image(image) for image in images]), max_side, quality)]
+    # 不需要缩小的帧不重新编码，避免白白消耗CPU
+    return [shrink(open_image(image), max_side, quality) if max(image_size(image)) > max_side else image
+            for image in images]
+
+def adapt_prompt(prompt, mode):
+    """拼图模式下补充画面排列说明"""
+    return prompt + TILE_PROMPT_HINT if mode == 'tile' else prompt
+
+def compare_modes(video_path, modes=IMAGE_MODES, group_count=5, max_side=448, quality=85):
+    """对同一视频的前group_count组分别用各图像模式请求模型，打印每组延迟和描述"""
+    import video_analyzer
+    from keyframe_stream import stream_keyframes
+    from shot_segmenter import segment_shots
+
+    config = {}
+    if os.path.exists('src/config.json'):
+        with open('src/config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+    groups = []
+    frames = stream_keyframes(video_path)
+    try:
+        for group in segment_shots(frames):
+            groups.append([frame['image'] for frame in group['frames']])
+            if len(groups) >= group_count:
+                break
+    finally:
+        frames.close()
+
+    results = {}
+    for mode in modes:
+        latencies = []
+        print(f"\n=== 图像模式: {mode} ===")
+        for idx, images in enumerate(groups):
+            start = time.perf_counter()
+            desc = video_analyzer.analyze_frames(
+                images,
+                model_name=config.get('model_name'),
+                prompt=config.get('prompt'),
+                image_prep={'mode': mode, 'max_side': max_side, 'quality': quality}
+            )
+            latencies.append(time.perf_counter() - start)
+            print(f"组 {idx+1}: {latencies[-1]:.2f}s | {desc}")
+        results[mode] = sum(latencies) / len(latencies) if latencies else 0.0
+
+    print("\n=== 平均每组延迟 ===")
+    for mode, avg in results.items():
+        print(f"{mode}: {avg:.2f}s")
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="比较不同图像准备模式下每组的模型延迟")
+    parser.add_argument('video', help="用于测试的视频文件")
+    parser.add_argument('--groups', type=int, default=5, help="测试的关键帧组数")
+    parser.add_argument('--modes', nargs='+', default=list(IMAGE_MODES), choices=IMAGE_MODES)
+    parser.add_argument('--max-side', type=int, default=448, help="图像最长边(像素)")
+    parser.add_argument('--quality', type=int, default=85, help="JPEG质量")
+    args = parser.parse_args()
+    compare_modes(args.video, args.modes, args.groups, args.max_side, args.quality)
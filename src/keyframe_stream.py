@@ -0,0 +1,216 @@
+import os
+import re
+import time
+import queue
+import subprocess
+import threading
+
+# showinfo滤镜每输出一帧打印一行，其中pts_time为该帧的真实显示时间(秒)
+SHOWINFO_PTS = re.compile(r'^\[Parsed_showinfo[^\]]*\].*?\bpts_time:\s*(-?[\d.]+)')
+# -progress每行输出一个 键=值
+PROGRESS_LINE = re.compile(r'^[a-z_0-9]+=')
+
+def build_keyframe_cmd(video_path, scale_width=360, output_dir=None):
+    """构建关键帧提取命令
+    
+    output_dir为空时以MJPEG写入标准输出，否则写入output_dir/frame_%04d.jpg
+    """
+    if output_dir is None:
+        output = ['-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '2', 'pipe:1']
+    else:
+        output = ['-q:v', '2', os.path.join(output_dir, 'frame_%04d.jpg')]
+    return [
+        'ffmpeg',
+        '-hwaccel', 'auto',
+        '-hwaccel_device', '1',
+        '-hide_banner',
+        '-nostats',
+        '-progress', 'pipe:2',
+        '-loglevel', 'info',
+        '-i', video_path,
+        '-vf', f"select='eq(pict_type,I)',scale={scale_width}:-1,showinfo",
+        '-vsync', 'vfr'
+    ] + output
+
+def find_jpeg_end(buf, start=0):
+    """按JPEG段结构查找start处图像的结束位置，数据不完整时返回-1
+
+    熵编码数据中的0xFF会被填充为FF00，只有真正的标记才会被识别为段边界
+    """
+    if len(buf) < start + 2:
+        return -1
+    if buf[start:start + 2] != b'\xff\xd8':
+        raise ValueError("MJPEG流格式错误: 缺少SOI标记")
+    n = len(buf)
+    pos = start + 2
+    while True:
+        if pos + 2 > n:
+            return -1
+        if buf[pos] != 0xFF:
+            raise ValueError("MJPEG流格式错误: 段标记无效")
+        marker = buf[pos + 1]
+        if marker == 0xFF:  # 填充字节
+            pos += 1
+            continue
+        if marker == 0xD9:  # EOI
+            return pos + 2
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:  # 无长度的标记
+            pos += 2
+            continue
+        if pos + 4 > n:
+            return -1
+        pos += 2 + int.from_bytes(buf[pos + 2:pos + 4], 'big')
+        if marker != 0xDA:
+            continue
+        # SOS之后是熵编码数据，跳到下一个真正的标记
+        while True:
+            idx = buf.find(b'\xff', pos)
+            if idx == -1 or idx + 1 >= n:
+                return -1
+            following = buf[idx + 1]
+            if following == 0x00 or 0xD0 <= following <= 0xD7:
+                pos = idx + 2
+            elif following == 0xFF:
+                pos = idx + 1
+            else:
+                pos = idx
+                break
+
+def split_jpeg_stream(stream, chunk_size=1 << 16):
+    """从MJPEG字节流中逐个切分出完整的JPEG图像"""
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        while buffer:
+            end = find_jpeg_end(buffer)
+            if end == -1:
+                break
+            yield bytes(buffer[:end])
+            del buffer[:end]
+    if buffer:
+        raise ValueError(f"MJPEG流意外结束，剩余 {len(buffer)} 字节不完整数据")
+
+def parse_progress_value(value):
+    """解析-progress输出中的数值，N/A返回None"""
+    try:
+        return float(value.rstrip('x'))
+    except ValueError:
+        return None
+
+def build_progress_event(fields, duration=None):
+    """把一组-progress键值整理为进度事件
+    
+    事件包含已输出关键帧数frame、处理速率fps、已处理到的视频位置position(秒)、
+    相对实时的速度speed、预计剩余时间eta(秒，需要duration)以及是否结束done
+    """
+    out_time_us = parse_progress_value(fields.get('out_time_us', 'N/A'))
+    position = out_time_us / 1000000 if out_time_us is not None else None
+    speed = parse_progress_value(fields.get('speed', 'N/A'))
+    eta = None
+    if duration and position is not None and speed:
+        eta = max(duration - position, 0.0) / speed
+    return {
+        'frame': int(parse_progress_value(fields.get('frame', '0')) or 0),
+        'fps': parse_progress_value(fields.get('fps', 'N/A')),
+        'position': position,
+        'duration': duration,
+        'speed': speed,
+        'eta': eta,
+        'done': fields.get('progress') == 'end'
+    }
+
+def read_ffmpeg_stderr(stream, pts_queue, error_lines, on_progress=None, duration=None):
+    """读取FFmpeg的stderr
+    
+    showinfo中的帧时间戳放入队列；-progress输出的键值块整理为进度事件交给on_progress；
+    其余输出保留最后若干行作为错误信息
+    """
+    fields = {}
+    for raw in iter(stream.readline, b''):
+        line = raw.decode('utf-8', 'replace').rstrip()
+        match = SHOWINFO_PTS.match(line)
+        if match:
+            pts_queue.put(float(match.group(1)))
+        elif PROGRESS_LINE.match(line):
+            key, value = line.split('=', 1)
+            fields[key] = value.strip()
+            # 每个进度块以progress=continue/end结尾
+            if key == 'progress':
+                if on_progress:
+                    on_progress(build_progress_event(fields, duration))
+                fields = {}
+        elif line:
+            error_lines.append(line)
+            del error_lines[:-20]
+    pts_queue.put(None)
+
+def iter_written_frames(output_dir, process, poll_interval=0.2):
+    """在FFmpeg运行期间按顺序产出已写完的关键帧路径
+    
+    第n帧在第n+1帧出现(或进程退出)后才视为写入完成
+    """
+    frame_idx = 1
+    while True:
+        finished = process.poll() is not None
+        while True:
+            current = os.path.join(output_dir, f'frame_{frame_idx:04d}.jpg')
+            following = os.path.join(output_dir, f'frame_{frame_idx + 1:04d}.jpg')
+            if os.path.exists(following) or (finished and os.path.exists(current)):
+                yield current
+                frame_idx += 1
+            else:
+                break
+        if finished:
+            break
+        time.sleep(poll_interval)
+
+def stream_keyframes(video_path, scale_width=360, output_dir=None, pts_timeout=60, on_progress=None,
+                     duration=None):
+    """启动FFmpeg并逐帧产出关键帧
+    
+    每帧为 {'index': 序号(从1开始), 'image': JPEG字节或文件路径, 'pts': 显示时间(秒)}，
+    解码仍在进行时即可取到前面的帧。output_dir为空时经管道读入内存，否则写入该目录。
+    on_progress在stderr读取线程中接收进度事件(见build_progress_event)，提供duration时可计算eta
+    """
+    cmd = build_keyframe_cmd(video_path, scale_width, output_dir)
+    if output_dir is None:
+        print("使用显卡加速模式(管道流式读取)...")
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        images = split_jpeg_stream(process.stdout)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        print("使用显卡加速模式...")
+        process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        images = iter_written_frames(output_dir, process)
+
+    # 单独线程读取stderr，防止管道写满导致FFmpeg阻塞
+    pts_queue = queue.Queue()
+    error_lines = []
+    stderr_thread = threading.Thread(
+        target=read_ffmpeg_stderr,
+        args=(process.stderr, pts_queue, error_lines, on_progress, duration),
+        daemon=True
+    )
+    stderr_thread.start()
+
+    try:
+        for index, image in enumerate(images, 1):
+            # showinfo在编码前打印，正常情况下时间戳总是先于图像到达
+            try:
+                pts = pts_queue.get(timeout=pts_timeout)
+            except queue.Empty:
+                raise RuntimeError("无法从FFmpeg输出中读取关键帧时间戳，请确认FFmpeg支持showinfo滤镜")
+            yield {'index': index, 'image': image, 'pts': pts}
+        process.wait()
+        stderr_thread.join()
+        if process.returncode != 0:
+            raise RuntimeError(f"显卡加速失败，请检查显卡驱动和FFmpeg配置: {' '.join(error_lines[-5:])}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if process.stdout:
+            process.stdout.close()
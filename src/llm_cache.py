@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+class LlmResponseCache:
+    """大模型回复的持久化缓存(ai_auto_processor和mad_script_generator共用)
+
+    键由模型名、对话消息(系统提示词+用户提示词)和采样参数共同决定；
+    超过max_age_days的条目视为过期，总条数或总大小超限时按最近使用时间淘汰(LRU)。
+    bypass为True时不读取缓存但仍写入新结果，用于强制刷新
+    """
+
+    def __init__(self, path='cache/llm_responses.sqlite3', max_entries=2000, max_mb=200, max_age_days=30,
+                 bypass=False):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, messages, params=None):
+        """根据模型名、对话消息和采样参数计算缓存键"""
+        payload = json.dumps([model, messages, params or {}], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """读取缓存，未命中、已过期或bypass时返回None"""
+        with self._lock:
+            if self.bypass:
+                self.misses += 1
+                return None
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is not None and self.max_age and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, model, response):
+        """写入缓存，并淘汰过期条目和超出数量/大小上限的最久未使用条目"""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, model, response, size, now, now)
+            )
+            if self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age,))
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                evict = []
+                for old_key, old_size in self._conn.execute(
+                        "SELECT key, size FROM responses WHERE key != ? ORDER BY last_used ASC", (key,)):
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    evict.append((old_key,))
+                    count -= 1
+                    total -= old_size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+            self._conn.commit()
+
+    def stats(self):
+        """返回命中统计"""
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'size_mb': round(total / 1024 / 1024, 2)
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def load_llm_cache(config):
+    """按config.json中的llm_cache配置返回缓存，未启用时返回None
+
+    同一路径在进程内共用一个实例，报告生成和剪辑脚本生成的命中统计合在一起
+    """
+    cache_config = config.get('llm_cache', {})
+    if not cache_config.get('enabled', True):
+        return None
+    path = cache_config.get('path', 'cache/llm_responses.sqlite3')
+    with _shared_lock:
+        cache = _shared.get(path)
+        if cache is None:
+            cache = _shared[path] = LlmResponseCache(
+                path=path,
+                max_entries=cache_config.get('max_entries', 2000),
+                max_mb=cache_config.get('max_mb', 200),
+                max_age_days=cache_config.get('max_age_days', 30)
+            )
+        cache.bypass = cache_config.get('bypass', False)
+        return cache
+
+def print_cache_stats(config):
+    """打印本进程内大模型回复缓存的命中统计(本次未查询过缓存时不打印)"""
+    cache = load_llm_cache(config)
+    if cache is None:
+        return
+    stats = cache.stats()
+    if stats['hits'] + stats['misses'] == 0:
+        return
+    print(f"\n大模型回复缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+          f"命中率 {stats['hit_rate']:.0%}, 共 {stats['entries']} 条({stats['size_mb']} MB)")
@@ -0,0 +1,226 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from openai import AsyncOpenAI, APIStatusError, APIConnectionError, APITimeoutError
+from llm_cache import load_llm_cache
+
+def estimate_tokens(text):
+    """粗略估算token数: 中文约0.6 token/字，其他字符约0.3 token/字符"""
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+class RateLimiter:
+    """滑动窗口限流: 任意60秒内请求数不超过rpm、token数不超过tpm(为0表示不限)"""
+
+    def __init__(self, rpm=0, tpm=0, window=60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._events = deque()  # (时间, token数)
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            self._tokens -= self._events.popleft()[1]
+
+    def _wait_time(self, now, tokens):
+        """还需等待的秒数；窗口为空时总是放行，避免超大请求永远等待"""
+        if not self._events:
+            return 0.0
+        waits = [0.0]
+        if self.rpm and len(self._events) + 1 > self.rpm:
+            waits.append(self._events[len(self._events) - self.rpm][0] + self.window - now)
+        if self.tpm and self._tokens + tokens > self.tpm:
+            excess = self._tokens + tokens - self.tpm
+            for timestamp, used in self._events:
+                excess -= used
+                if excess <= 0:
+                    waits.append(timestamp + self.window - now)
+                    break
+        return max(waits)
+
+    async def acquire(self, tokens):
+        """等待到预算允许后登记一次请求，返回登记项，供拿到实际用量后修正"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    entry = [now, tokens]
+                    self._events.append(entry)
+                    self._tokens += tokens
+                    return entry
+                await asyncio.sleep(wait)
+
+    def settle(self, entry, actual_tokens):
+        """用服务端返回的实际token数替换预估值"""
+        if entry in self._events:
+            self._tokens += actual_tokens - entry[1]
+            entry[1] = actual_tokens
+
+def is_retryable(error):
+    """429、5xx、连接错误和超时可以重试"""
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+def retry_after(error):
+    """读取服务端建议的重试等待时间(秒)"""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('retry-after') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class LlmDispatcher:
+    """异步的大模型请求调度器
+
+    在后台线程中运行事件循环，任何线程都可以用submit()提交请求并立即拿到Future，
+    例如批处理在生成本集报告的同时继续分析下一集的画面。所有请求共享
+    rpm/tpm预算，最多max_concurrent个同时进行；429和5xx以带抖动的指数退避重试。
+    指定cache(LlmResponseCache)时，相同的请求直接返回缓存结果，不占用预算
+    """
+
+    def __init__(self, api_key, base_url, rpm=0, tpm=0, max_concurrent=4, max_retries=5,
+                 backoff_base=2.0, backoff_max=60.0, expected_output_tokens=2000, cache=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_output_tokens = expected_output_tokens
+        self.cache = cache
+        self.stats = {'requests': 0, 'cache_hits': 0, 'retries': 0, 'failures': 0,
+                      'prompt_tokens': 0, 'completion_tokens': 0}
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        # 客户端、信号量和限流器都需在事件循环线程中创建
+        self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._limiter = RateLimiter(self.rpm, self.tpm)
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _backoff(self, attempt, error):
+        suggested = retry_after(error)
+        if suggested is not None:
+            return suggested + random.uniform(0, 1)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _request(self, model, messages, output_path, **kwargs):
+        """请求一次回复，返回(回复文本, 用量)；传入output_path时以流式请求边生成边写入该文件"""
+        if output_path is None:
+            response = await self._client.chat.completions.create(
+                model=model, messages=messages, stream=False, **kwargs)
+            return response.choices[0].message.content, getattr(response, 'usage', None)
+        # 与llm_stream相互引用，在使用时导入
+        from llm_stream import StreamWriter
+        usage = None
+        writer = StreamWriter(output_path, echo=False)
+        try:
+            response = await self._client.chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={'include_usage': True}, **kwargs)
+            async for chunk in response:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                if chunk.choices:
+                    writer.write(chunk.choices[0].delta.content)
+            writer.finish()
+        finally:
+            writer.close()
+        return writer.text, usage
+
+    async def complete(self, model, messages, recorder=None, output_path=None, **kwargs):
+        """发送一次对话请求，返回回复文本
+
+        recorder(UsageRecorder)记录token数、等待预算和并发名额的时间以及请求耗时；
+        传入output_path时以流式请求边生成边写入该文件(命中缓存时直接写入)，重试时重新写入
+        """
+        key = self.cache.make_key(model, messages, kwargs) if self.cache else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.stats['cache_hits'] += 1
+                if recorder is not None:
+                    recorder.record(model, cached=True)
+                if output_path is not None:
+                    with open(output_path, 'w', encoding='utf-8') as f:
+                        f.write(cached)
+                return cached
+        estimate = sum(estimate_tokens(m['content']) for m in messages) + self.expected_output_tokens
+        queued = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            entry = await self._limiter.acquire(estimate)
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    content, usage = await self._request(model, messages, output_path, **kwargs)
+                    latency = time.perf_counter() - started
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    self.stats['failures'] += 1
+                    raise
+                self.stats['retries'] += 1
+                wait = self._backoff(attempt, e)
+                print(f"\n大模型请求失败({type(e).__name__})，{wait:.1f}s后第 {attempt+1} 次重试")
+                await asyncio.sleep(wait)
+                continue
+            if usage is not None:
+                self._limiter.settle(entry, usage.total_tokens)
+                self.stats['prompt_tokens'] += usage.prompt_tokens
+                self.stats['completion_tokens'] += usage.completion_tokens
+            self.stats['requests'] += 1
+            if recorder is not None:
+                # 排队时间包含等待预算、并发名额和重试退避的时间
+                recorder.record(model, prompt_tokens=usage.prompt_tokens if usage else 0,
+                                completion_tokens=usage.completion_tokens if usage else 0,
+                                queue_wait=time.perf_counter() - queued - latency, latency=latency,
+                                retries=attempt)
+            if key is not None:
+                self.cache.put(key, model, content)
+            return content
+
+    def submit(self, model, messages, recorder=None, output_path=None, **kwargs):
+        """从任意线程提交请求，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self.complete(model, messages, recorder, output_path, **kwargs),
+                                                self._loop)
+
+    def close(self):
+        """停止事件循环(已提交的请求应先完成)"""
+        async def shutdown():
+            await self._client.close()
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+def load_dispatcher(config):
+    """按config.json中ai_auto_processor的配置创建调度器"""
+    ai_config = config['ai_auto_processor']
+    limits = ai_config.get('rate_limit', {})
+    return LlmDispatcher(
+        api_key=ai_config['api_key'],
+        base_url=ai_config['base_url'],
+        rpm=limits.get('rpm', 0),
+        tpm=limits.get('tpm', 0),
+        max_concurrent=limits.get('max_concurrent', 4),
+        max_retries=limits.get('max_retries', 5),
+        expected_output_tokens=limits.get('expected_output_tokens', 2000),
+        cache=load_llm_cache(config)
+    )
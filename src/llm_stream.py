@@ -0,0 +1,136 @@
+import re
+import time
+from llm_dispatcher import estimate_tokens
+
+# 表格分隔行: |------|:----:|
+TABLE_SEPARATOR = re.compile(r'^\|[\s:|-]+\|$')
+
+class TableRowCollector:
+    """从流式输出中逐行取出完整的表格数据行
+
+    与auto_cut_video.parse_markdown一致，表头分隔行之后的"|"开头的行才算数据行
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._in_table = False
+
+    def _take(self, line):
+        line = line.strip()
+        if not line.startswith('|'):
+            return None
+        if TABLE_SEPARATOR.match(line):
+            self._in_table = True
+            return None
+        return line if self._in_table else None
+
+    def feed(self, text):
+        """追加一段输出，返回其中新完成的数据行"""
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split('\n')
+        return [row for row in map(self._take, lines) if row]
+
+    def close(self):
+        """输出结束，返回最后一行(没有换行结尾时)"""
+        row = self._take(self._buffer)
+        self._buffer = ''
+        return [row] if row else []
+
+class StreamWriter:
+    """逐段写入文件和终端，每完成一个表格行就调用on_row(row)
+
+    文件在每段写入后立即flush，生成过程中即可查看已完成的部分；
+    write_stream和LlmDispatcher的异步流式请求共用
+    """
+
+    def __init__(self, output_path=None, on_row=None, echo=True):
+        self.on_row = on_row
+        self.echo = echo
+        self.parts = []
+        self._collector = TableRowCollector()
+        self._output = open(output_path, 'w', encoding='utf-8') if output_path else None
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    def write(self, delta):
+        if not delta:
+            return
+        self.parts.append(delta)
+        if self._output:
+            self._output.write(delta)
+            self._output.flush()
+        if self.echo:
+            print(delta, end='', flush=True)
+        if self.on_row:
+            for row in self._collector.feed(delta):
+                self.on_row(row)
+
+    def finish(self):
+        """输出完整结束，交付最后一行(没有换行结尾时)"""
+        if self.on_row:
+            for row in self._collector.close():
+                self.on_row(row)
+
+    def close(self):
+        if self._output:
+            self._output.close()
+            self._output = None
+        if self.echo:
+            print()
+
+def write_stream(deltas, output_path=None, on_row=None, echo=True):
+    """把逐段到达的文本写入文件和终端，每完成一个表格行就调用on_row(row)，返回完整文本"""
+    writer = StreamWriter(output_path, on_row, echo)
+    try:
+        for delta in deltas:
+            writer.write(delta)
+        writer.finish()
+    finally:
+        writer.close()
+    return writer.text
+
+def stream_chat(client, model, messages, output_path=None, on_row=None, echo=True, usage=None):
+    """以stream=True调用OpenAI兼容接口，边生成边写入文件和终端，返回完整回复
+
+    usage为字典时填入服务端在最后一段返回的token用量和首段到达时间(秒)
+    """
+    started = time.perf_counter()
+    response = client.chat.completions.create(model=model, messages=messages, stream=True,
+                                              stream_options={'include_usage': True})
+
+    def deltas():
+        for chunk in response:
+            if usage is not None and getattr(chunk, 'usage', None):
+                usage['prompt_tokens'] = chunk.usage.prompt_tokens
+                usage['completion_tokens'] = chunk.usage.completion_tokens
+            if chunk.choices:
+                if usage is not None and 'first_token_seconds' not in usage:
+                    usage['first_token_seconds'] = round(time.perf_counter() - started, 4)
+                yield chunk.choices[0].delta.content
+
+    return write_stream(deltas(), output_path, on_row, echo)
+
+def complete_chat(client, model, messages, stream=True, output_path=None, on_row=None, echo=True, recorder=None):
+    """请求一次对话(流式或非流式)，写入文件/终端，并向recorder(UsageRecorder)记录用量，返回完整回复
+
+    服务端没有返回用量时按字数估算token数，并在记录中标出estimated
+    """
+    started = time.perf_counter()
+    usage = {}
+    if stream:
+        result = stream_chat(client, model, messages, output_path, on_row, echo, usage=usage)
+    else:
+        response = client.chat.completions.create(model=model, messages=messages, stream=False)
+        if response.usage is not None:
+            usage = {'prompt_tokens': response.usage.prompt_tokens,
+                     'completion_tokens': response.usage.completion_tokens}
+        result = write_stream([response.choices[0].message.content], output_path, on_row, echo)
+    if recorder is not None:
+        estimated = 'prompt_tokens' not in usage
+        if estimated:
+            usage['prompt_tokens'] = sum(estimate_tokens(m['content']) for m in messages)
+            usage['completion_tokens'] = estimate_tokens(result)
+        recorder.record(model, latency=time.perf_counter() - started, estimated=estimated, **usage)
+    return result
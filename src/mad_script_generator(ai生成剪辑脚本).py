@@ -1,7 +1,13 @@
 import os
 import json
+import argparse
+import importlib
 from datetime import datetime
 from openai import OpenAI
+from llm_cache import load_llm_cache, print_cache_stats
+from llm_stream import complete_chat, write_stream
+from usage_meter import load_usage_meter
+from corpus_compactor import compact_corpus
 
 class MadScriptGenerator:
     def __init__(self):
@@ -10,6 +16,8 @@ class MadScriptGenerator:
             api_key=self.config['api_key'],
             base_url=self.config['base_url']
         )
+        self.cache = load_llm_cache(self.config)
+        self.meter = load_usage_meter(self.config)
         self.output_dir = "ai剪辑脚本"
         os.makedirs(self.output_dir, exist_ok=True)
 
@@ -20,7 +28,11 @@ class MadScriptGenerator:
         return {
             'api_key': config['ai_auto_processor']['api_key'],
             'base_url': config['ai_auto_processor']['base_url'],
-            'model': config['ai_auto_processor']['model']
+            'model': config['ai_auto_processor']['model'],
+            'stream': config['ai_auto_processor'].get('stream', True),
+            'llm_cache': config.get('llm_cache', {}),
+            'usage': config.get('usage', {}),
+            'corpus_compaction': config.get('corpus_compaction', {})
         }
 
     def load_prompts(self):
@@ -38,12 +50,25 @@ class MadScriptGenerator:
         return system_prompt, user_prompt_template
 
     def load_content(self):
-        """加载ai分析数据内容"""
+        """加载ai分析数据内容
+
+        开启corpus_compaction时改写为紧凑格式并控制在token_budget以内
+        """
         content_dir = "ai分析数据"
         content = ""
         file_count = 0
         
         print("\n正在加载分析数据...")
+        compaction = self.config['corpus_compaction']
+        if compaction.get('enabled', True):
+            content, stats = compact_corpus(content_dir, compaction.get('token_budget', 0))
+            print(f"已加载 {stats['files']} 个分析数据文件，压缩为 {stats['shots']} 个镜头: "
+                  f"约 {stats['original_tokens']} → {stats['tokens']} tokens (压缩级别 {stats['level']})")
+            if stats['dropped']:
+                print(f"警告: 超出token预算，已省略 {stats['dropped']} 个最短的镜头")
+            if not content:
+                print("警告: 未加载任何有效分析数据")
+            return content
         for filename in sorted(os.listdir(content_dir)):
             filepath = os.path.join(content_dir, filename)
             if os.path.isfile(filepath) and not filename.startswith('.'):
@@ -66,43 +91,38 @@ class MadScriptGenerator:
             return None
         return user_input
 
-    def call_deepseek(self, system_prompt, user_prompt):
-        """调用Deepseek API"""
-        response = self.client.chat.completions.create(
-            model=self.config['model'],
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            stream=False
-        )
-        return response.choices[0].message.content
+    def call_deepseek(self, system_prompt, user_prompt, output_path=None, on_row=None):
+        """调用Deepseek API，相同的提示词和需求优先使用缓存的回复
 
-    def save_result(self, result):
-        """保存结果到MD文件，覆盖已有文件"""
-        filename = "mad_script.md"
-        filepath = os.path.join(self.output_dir, filename)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(result)
-        print(f"\n结果已保存到: {filepath} (覆盖原有内容)")
+        开启stream时边生成边写入output_path并输出到终端，每完成一个表格行调用on_row(row)；
+        每次调用的token数、耗时和估算费用记入usage/calls.jsonl
+        """
+        recorder = self.meter.recorder('script') if self.meter else None
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        key = self.cache.make_key(self.config['model'], messages) if self.cache else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                print("使用缓存的大模型回复")
+                if recorder is not None:
+                    recorder.record(self.config['model'], cached=True)
+                return write_stream([cached], output_path, on_row)
+        result = complete_chat(self.client, self.config['model'], messages, self.config['stream'],
+                               output_path, on_row, recorder=recorder)
+        if key is not None:
+            self.cache.put(key, self.config['model'], result)
+        return result
 
-    def run(self):
-        """主运行流程"""
-        print("=== MAD剪辑脚本生成器 ===")
-        
-        # 加载提示词和内容
-        system_prompt, user_prompt_template = self.load_prompts()
-        content = self.load_content()
-        
-        while True:
-            # 获取用户输入
-            user_input = self.get_user_input()
-            if user_input is None:
-                break
-                
-            # 构建完整提示词并确保使用分析数据
-            full_prompt = f"""根据以下分析数据和用户需求生成剪辑脚本：
+    def result_path(self):
+        """剪辑脚本保存路径，每次生成覆盖已有文件"""
+        return os.path.join(self.output_dir, "mad_script.md")
+
+    def build_prompt(self, content, user_input):
+        """构建完整提示词并确保使用分析数据"""
+        return f"""根据以下分析数据和用户需求生成剪辑脚本：
             
             【分析数据内容】
             {content}
@@ -121,18 +141,54 @@ class MadScriptGenerator:
             2. 每个镜头选择必须引用具体分析数据
             3. 保持原有输出格式
             4. 确保时间轴连贯性"""
+
+    def generate(self, user_input, system_prompt=None, content=None, on_row=None):
+        """按一条剪辑需求生成脚本并保存，返回脚本内容(非交互，供流水线调用)
+
+        脚本边生成边写入mad_script.md和终端，on_row(row)在每个表格行完成时调用
+        """
+        if system_prompt is None:
+            system_prompt, _ = self.load_prompts()
+        if content is None:
+            content = self.load_content()
+        print("\n正在生成剪辑脚本...")
+        filepath = self.result_path()
+        result = self.call_deepseek(system_prompt, self.build_prompt(content, user_input), filepath, on_row)
+        print(f"\n结果已保存到: {filepath} (覆盖原有内容)")
+        print_cache_stats(self.config)
+        if self.meter is not None:
+            self.meter.write_summary()
+        return result
+
+    def run(self, cut=False):
+        """主运行流程，cut为True时每完成一个脚本行就开始切割对应片段"""
+        print("=== MAD剪辑脚本生成器 ===")
+        
+        # 加载提示词和内容
+        system_prompt, user_prompt_template = self.load_prompts()
+        content = self.load_content()
+        
+        while True:
+            # 获取用户输入
+            user_input = self.get_user_input()
+            if user_input is None:
+                break
+                
+            cutter = None
+            if cut:
+                cutter = importlib.import_module('auto_cut_video(视频切割)').ClipCutter()
             
-            # 调用API
-            print("\n正在生成剪辑脚本...")
-            result = self.call_deepseek(system_prompt, full_prompt)
-            
-            # 输出结果
+            # 脚本在生成过程中逐段输出
             print("\n=== 生成的剪辑脚本 ===")
-            print(result)
-            
-            # 保存结果
-            self.save_result(result)
+            try:
+                self.generate(user_input, system_prompt, content, on_row=cutter.add_row if cutter else None)
+            finally:
+                if cutter:
+                    cutter.wait()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="根据分析数据和剪辑需求生成MAD剪辑脚本")
+    parser.add_argument('--cut', action='store_true', help="边生成脚本边切割已完成的片段")
+    args = parser.parse_args()
     generator = MadScriptGenerator()
-    generator.run()
+    generator.run(cut=args.cut)
@@ -0,0 +1,168 @@
+import os
+import json
+import bisect
+import threading
+import subprocess
+from fractions import Fraction
+
+CACHE_PATH = os.path.join('cache', 'media_probe.json')
+
+_lock = threading.Lock()
+_cache = None
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        _cache = {}
+        if os.path.exists(CACHE_PATH):
+            try:
+                with open(CACHE_PATH, 'r', encoding='utf-8') as f:
+                    _cache = json.load(f)
+            except (OSError, ValueError):
+                print(f"警告: 媒体信息缓存 {CACHE_PATH} 损坏，已忽略")
+    return _cache
+
+def _save_cache():
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    tmp_path = CACHE_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_cache, f, ensure_ascii=False)
+    os.replace(tmp_path, CACHE_PATH)
+
+def _cached(path, field, compute):
+    """按(路径, 大小, 修改时间)缓存某项探测结果，文件变化后自动失效"""
+    path = os.path.abspath(str(path))
+    stat = os.stat(path)
+    with _lock:
+        entry = _load_cache().get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            if field in entry:
+                return entry[field]
+        else:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    value = compute(path)
+    with _lock:
+        entry[field] = value
+        _load_cache()[path] = entry
+        _save_cache()
+    return value
+
+def parse_rate(rate):
+    """解析"24000/1001"形式的帧率，无效时返回None"""
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float(value) if value else None
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _run_ffprobe(path):
+    """执行一次ffprobe，返回整理后的格式和流信息"""
+    result = subprocess.run([
+        'ffprobe',
+        '-v', 'error',
+        '-show_format',
+        '-show_streams',
+        '-of', 'json',
+        path
+    ], capture_output=True, text=True, encoding='utf-8')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe读取失败: {path}: {result.stderr.strip()}")
+    raw = json.loads(result.stdout)
+    fmt = raw.get('format', {})
+    streams = []
+    for stream in raw.get('streams', []):
+        streams.append({
+            'index': stream.get('index'),
+            'codec_type': stream.get('codec_type'),
+            'codec_name': stream.get('codec_name'),
+            'width': _to_int(stream.get('width')),
+            'height': _to_int(stream.get('height')),
+            'pix_fmt': stream.get('pix_fmt'),
+            'frame_rate': parse_rate(stream.get('avg_frame_rate')) or parse_rate(stream.get('r_frame_rate')),
+            'sample_rate': _to_int(stream.get('sample_rate')),
+            'channels': _to_int(stream.get('channels')),
+            'duration': _to_float(stream.get('duration'))
+        })
+    return {
+        'format_name': fmt.get('format_name'),
+        'duration': _to_float(fmt.get('duration')),
+        'size': _to_int(fmt.get('size')),
+        'bit_rate': _to_int(fmt.get('bit_rate')),
+        'streams': streams
+    }
+
+def probe_media(path):
+    """获取媒体文件的格式和流信息(带磁盘缓存)
+
+    返回 {'format_name', 'duration', 'size', 'bit_rate', 'streams': [...]}，
+    每个流包含codec_type、codec_name、width、height、frame_rate、sample_rate等字段
+    """
+    return _cached(path, 'probe', _run_ffprobe)
+
+def get_stream(path, codec_type='video'):
+    """获取第一个指定类型的流，不存在时返回None"""
+    for stream in probe_media(path)['streams']:
+        if stream['codec_type'] == codec_type:
+            return stream
+    return None
+
+def get_duration(path):
+    """获取媒体时长(秒)"""
+    info = probe_media(path)
+    if info['duration'] is not None:
+        return info['duration']
+    # 部分容器只在流上记录时长
+    durations = [s['duration'] for s in info['streams'] if s['duration'] is not None]
+    if not durations:
+        raise RuntimeError(f"无法获取媒体时长: {path}")
+    return max(durations)
+
+def get_frame_rate(path):
+    """获取视频帧率"""
+    stream = get_stream(path, 'video')
+    if stream is None or stream['frame_rate'] is None:
+        raise RuntimeError(f"无法获取视频帧率: {path}")
+    return stream['frame_rate']
+
+def _run_keyframe_scan(path):
+    """读取视频流的数据包标记(不解码)，返回所有关键帧时间"""
+    result = subprocess.run([
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe读取关键帧失败: {path}: {result.stderr.strip()}")
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+def get_keyframe_times(path):
+    """获取视频所有关键帧时间(秒，升序，带磁盘缓存)"""
+    return _cached(path, 'keyframes', _run_keyframe_scan)
+
+def nearest_keyframes(path, timestamp):
+    """返回timestamp前后最近的关键帧时间(前, 后)，不存在的一侧为None"""
+    keyframes = get_keyframe_times(path)
+    idx = bisect.bisect_left(keyframes, timestamp)
+    before = keyframes[idx - 1] if idx > 0 else None
+    after = keyframes[idx] if idx < len(keyframes) else None
+    return before, after
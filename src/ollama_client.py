@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+from urllib.parse import urlparse
+import httpx
+import ollama
+
+DEFAULT_HOST = 'http://localhost:11434'
+
+LOCAL_HOSTNAMES = ('localhost', '127.0.0.1', '::1', '0.0.0.0')
+
+def is_local_host(host):
+    """判断Ollama地址是否指向本机(地址可以不带http://)"""
+    parsed = urlparse(host if '//' in host else f'http://{host}')
+    return parsed.hostname in LOCAL_HOSTNAMES
+
+def build_options(config=None, max_concurrent=1, host=DEFAULT_HOST):
+    """根据配置确定推理参数
+
+    num_thread未配置时，本机服务按本机CPU核心数平均分给并发请求，远程主机交给服务端自行决定；
+    num_ctx未配置时使用模型默认值
+    """
+    config = config or {}
+    options = {}
+    if config.get('num_thread'):
+        options['num_thread'] = config['num_thread']
+    elif is_local_host(host):
+        options['num_thread'] = max(1, (os.cpu_count() or 2) // max(1, max_concurrent))
+    if config.get('num_ctx'):
+        options['num_ctx'] = config['num_ctx']
+    return options
+
+class OllamaSession:
+    """长期复用的Ollama连接
+
+    所有关键帧组共用一个带连接池的客户端；每个模型只在首次使用时预热一次，
+    并通过keep_alive让模型在批处理期间常驻显存。模型加载耗时与推理耗时分开统计
+    """
+
+    def __init__(self, host=DEFAULT_HOST, keep_alive='30m', options=None, max_connections=4):
+        self.host = host
+        self.keep_alive = keep_alive
+        self.options = options if options is not None else build_options()
+        self.client = ollama.Client(
+            host=host,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.stats = {'calls': 0, 'load_seconds': 0.0, 'warmup_seconds': 0.0, 'inference_seconds': 0.0}
+        self._warmed = set()
+        self._lock = threading.Lock()
+
+    def ensure_model(self, model_name):
+        """首次使用模型时预热(空提示词只加载模型)，之后直接返回"""
+        with self._lock:
+            if model_name in self._warmed:
+                return
+            start = time.perf_counter()
+            response = self.client.generate(model=model_name, prompt='', keep_alive=self.keep_alive)
+            elapsed = time.perf_counter() - start
+            load_seconds = (response.get('load_duration') or 0) / 1e9
+            self.stats['warmup_seconds'] += elapsed
+            self.stats['load_seconds'] += load_seconds
+            self._warmed.add(model_name)
+        print(f"\n模型 {model_name} 已就绪: 加载 {load_seconds:.2f}s, 常驻 {self.keep_alive}")
+
+    def generate(self, model_name, prompt, images):
+        """对一组图像发起一次推理请求"""
+        self.ensure_model(model_name)
+        response = self.client.generate(
+            model=model_name,
+            prompt=prompt,
+            images=images,
+            options=self.options,
+            keep_alive=self.keep_alive
+        )
+        with self._lock:
+            self.stats['calls'] += 1
+            # 模型被意外卸载时这里会出现非零加载时间
+            self.stats['load_seconds'] += (response.get('load_duration') or 0) / 1e9
+            self.stats['inference_seconds'] += ((response.get('total_duration') or 0)
+                                                - (response.get('load_duration') or 0)) / 1e9
+        return response
+
+    def summary(self):
+        """返回加载与推理耗时统计"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['avg_inference_seconds'] = stats['inference_seconds'] / stats['calls'] if stats['calls'] else 0.0
+        return stats
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(host=DEFAULT_HOST, **kwargs):
+    """获取指定地址的共享会话
+
+    创建时不访问服务，首次推理前的模型预热即连接检查，因此全部命中缓存时无需启动Ollama
+    """
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = OllamaSession(host=host, **kwargs)
+            _sessions[host] = session
+        return session
+
+def load_session(config, max_concurrent=1, host=None):
+    """按config.json中的ollama配置创建共享会话，host未指定时使用base_url"""
+    ollama_config = config.get('ollama', {})
+    host = host or ollama_config.get('base_url', DEFAULT_HOST)
+    return get_session(
+        host=host,
+        keep_alive=ollama_config.get('keep_alive', '30m'),
+        options=build_options(ollama_config, max_concurrent, host),
+        max_connections=max(1, max_concurrent)
+    )
@@ -0,0 +1,398 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import importlib
+import threading
+
+STATE_PATH = os.path.join('cache', 'pipeline_state.json')
+HASH_CACHE_PATH = os.path.join('cache', 'file_hashes.json')
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VIDEO_DIR = os.path.join('input', '视频批处理', '视频')
+SUBTITLE_DIR = os.path.join('input', '视频批处理', '字幕')
+WORKSPACE_DIR = os.path.join('input', '视频批处理', '工作区')
+MUSIC_DIR = os.path.join('input', 'music_input')
+
+# 大于此大小的文件(视频、音乐)只对头尾各SAMPLE_BYTES字节和文件大小做摘要
+FULL_HASH_LIMIT = 64 * 1024 * 1024
+SAMPLE_BYTES = 4 * 1024 * 1024
+
+_hash_lock = threading.Lock()
+_hash_cache = None
+
+def _load_json(path):
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"警告: {path} 损坏，已忽略")
+    return {}
+
+def _save_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+def _digest_file(path, size):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if size <= FULL_HASH_LIMIT:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        else:
+            sha.update(str(size).encode())
+            sha.update(f.read(SAMPLE_BYTES))
+            f.seek(size - SAMPLE_BYTES)
+            sha.update(f.read(SAMPLE_BYTES))
+    return sha.hexdigest()
+
+def file_hash(path):
+    """文件内容摘要，按(路径, 大小, 修改时间)缓存，文件不存在时返回None"""
+    global _hash_cache
+    path = os.path.abspath(path)
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    with _hash_lock:
+        if _hash_cache is None:
+            _hash_cache = _load_json(HASH_CACHE_PATH)
+        entry = _hash_cache.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha1']
+    digest = _digest_file(path, stat.st_size)
+    with _hash_lock:
+        _hash_cache[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest}
+    return digest
+
+def save_hash_cache():
+    with _hash_lock:
+        if _hash_cache is not None:
+            _save_json(HASH_CACHE_PATH, _hash_cache)
+
+def expand(patterns):
+    """展开glob模式为排序后的文件列表"""
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in glob.glob(pattern) if os.path.isfile(p))
+    return sorted(paths)
+
+def load_module(name):
+    """导入src下的模块(支持带中文括号的文件名)"""
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    return importlib.import_module(name)
+
+def pick(config, *keys):
+    """取出配置中影响某阶段输出的参数，key可用"a.b"表示嵌套"""
+    params = {}
+    for key in keys:
+        value = config
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        params[key] = value
+    return params
+
+# ---------- 各阶段的目标与执行 ----------
+
+def music_targets(config):
+    music = load_module('music_config')
+    targets = []
+    for lyric in sorted(glob.glob(os.path.join(MUSIC_DIR, '*'))):
+        stem, ext = os.path.splitext(lyric)
+        if ext.lower() not in music.LYRIC_EXTENSIONS:
+            continue
+        audio = next((stem + e for e in music.AUDIO_EXTENSIONS if os.path.exists(stem + e)), None)
+        if audio is None:
+            continue
+        song_dir = os.path.join('output_Music', os.path.basename(stem))
+        targets.append({
+            'name': os.path.basename(lyric),
+            'inputs': [lyric, audio],
+            'outputs': [os.path.join(song_dir, 'storyboard.json'), os.path.join(song_dir, 'Music_report.md')],
+            'lyric': lyric,
+            'audio': audio
+        })
+    return targets
+
+def run_music(config, targets):
+    from pathlib import Path
+    analyzer = load_module('music_analyzer(音乐分析工具)')
+    analyzer.OUTPUT_DIR.mkdir(exist_ok=True)
+    for target in targets:
+        lyric = Path(target['lyric'])
+        analyzer.process_lyrics(lyric)
+        analyzer.analyze_music(Path(target['audio']), analyzer.OUTPUT_DIR / f"{lyric.stem}_processed.txt")
+
+def analyze_targets(config):
+    batch = load_module('batch_video_processor(批量处理视频内容)')
+    if not os.path.isdir(VIDEO_DIR):
+        return []
+    videos = sorted(f for f in os.listdir(VIDEO_DIR) if f.endswith('.mkv'))
+    subtitles = batch.resolve_subtitles(videos, SUBTITLE_DIR) if os.path.isdir(SUBTITLE_DIR) else {}
+    targets = []
+    for video in videos:
+        name = os.path.splitext(video)[0]
+        inputs = [os.path.join(VIDEO_DIR, video)]
+        if subtitles.get(video):
+            inputs.append(subtitles[video])
+        targets.append({
+            'name': video,
+            'inputs': inputs,
+            'outputs': [os.path.join('output', name, 'report.txt'),
+                        os.path.join('output', name, f"{name}_subtitles.json")]
+        })
+    return targets
+
+def run_analyze(config, targets):
+    batch = load_module('batch_video_processor(批量处理视频内容)')
+    batch.process_batch(VIDEO_DIR, SUBTITLE_DIR, WORKSPACE_DIR, videos=[t['name'] for t in targets], ai_report=False)
+
+# video_analyzer.load_settings中影响报告内容的参数；并发数、刷新间隔等只影响速度，修改后不重新分析
+ANALYZE_OUTPUT_SETTINGS = ('model_name', 'prompt', 'frame_filter', 'segmentation', 'image_prep')
+
+def analyze_params(config):
+    """video_analyzer实际使用的、影响报告内容的参数，加上Ollama的num_ctx"""
+    settings = load_module('video_analyzer').load_settings(config)
+    params = {key: settings[key] for key in ANALYZE_OUTPUT_SETTINGS}
+    params.update(pick(config, 'ollama.num_ctx'))
+    return params
+
+def report_targets(config):
+    targets = []
+    for report in sorted(glob.glob(os.path.join('output', '*', 'report.txt'))):
+        folder = os.path.dirname(report)
+        name = os.path.basename(folder)
+        targets.append({
+            'name': name,
+            'inputs': [report] + expand([os.path.join(folder, '*_subtitles.json'),
+                                         os.path.join(folder, '*_subtitles.txt')]),
+            'outputs': [os.path.join('ai视频识别报告', f"{name}_ai_report.txt")],
+            'folder': folder
+        })
+    return targets
+
+def run_report(config, targets):
+    processor = load_module('ai_auto_processor')
+    dispatcher = load_module('llm_dispatcher').load_dispatcher(config)
+    try:
+        futures = [processor.submit_report(target['folder'], dispatcher, config) for target in targets]
+        for future in futures:
+            future.result()
+    finally:
+        dispatcher.close()
+
+def combine_targets(config):
+    return [{
+        'name': 'combined_reports',
+        'inputs': expand([os.path.join('ai视频识别报告', '*.txt')]),
+        'outputs': [os.path.join('ai分析数据', 'combined_reports.md')]
+    }]
+
+def run_combine(config, targets):
+    combiner = load_module('combine_reports(内容合并工具)')
+    os.makedirs('ai分析数据', exist_ok=True)
+    combiner.combine_reports('ai视频识别报告', os.path.join('ai分析数据', 'combined_reports.md'))
+
+def script_targets(config):
+    if not config.get('pipeline', {}).get('script_request'):
+        print("未配置pipeline.script_request，跳过剪辑脚本生成")
+        return []
+    return [{
+        'name': 'mad_script',
+        'inputs': expand([os.path.join('ai分析数据', '*'), os.path.join('mad剪辑提示词', '*.txt')]),
+        'outputs': [os.path.join('ai剪辑脚本', 'mad_script.md')]
+    }]
+
+def run_script(config, targets):
+    generator = load_module('mad_script_generator(ai生成剪辑脚本)').MadScriptGenerator()
+    generator.generate(config['pipeline']['script_request'])
+
+def cut_targets(config):
+    scripts = expand([os.path.join('ai剪辑脚本', '*.md')])
+    if not scripts:
+        return []
+    return [{
+        'name': 'clips',
+        'inputs': scripts + expand([os.path.join(VIDEO_DIR, '*.mkv')]),
+        'outputs': [os.path.join('ai切割素材', os.path.splitext(os.path.basename(s))[0], '*.mp4') for s in scripts]
+    }]
+
+def run_cut(config, targets):
+    load_module('auto_cut_video(视频切割)').main()
+
+def merge_targets(config):
+    clips = expand([os.path.join('ai切割素材', 'mad_script', '*.mp4')])
+    music = expand([os.path.join(MUSIC_DIR, '*.flac'), os.path.join(MUSIC_DIR, '*.mp3')])
+    if not clips or not music:
+        return []
+    return [{
+        'name': 'final',
+        'inputs': clips + music[:1],
+        'outputs': [os.path.join('最终输出视频', '*', '*_final.mp4')]
+    }]
+
+def run_merge(config, targets):
+    load_module('video_merger').main()
+
+# 声明式的阶段图：按顺序执行，每个阶段的输入是上游阶段的输出
+STAGES = [
+    {
+        'name': 'music',
+        'description': '音乐分析',
+        'targets': music_targets,
+        'run': run_music,
+        'params': lambda config: {},
+        'code': ['music_analyzer(音乐分析工具).py', 'music_config.py']
+    },
+    {
+        'name': 'analyze',
+        'description': '关键帧分析',
+        'targets': analyze_targets,
+        'run': run_analyze,
+        'params': analyze_params,
+        'code': ['batch_video_processor(批量处理视频内容).py', 'video_analyzer.py', 'media_probe.py',
+                 'keyframe_stream.py', 'frame_filter.py', 'shot_segmenter.py', 'image_prep.py',
+                 'ollama_client.py', 'vlm_router.py', 'frame_cache.py', 'analysis_journal.py',
+                 'subtitle_timeline.py', 'report_writer.py']
+    },
+    {
+        'name': 'report',
+        'description': 'AI报告',
+        'targets': report_targets,
+        'run': run_report,
+        'params': lambda config: pick(config, 'ai_auto_processor.model', 'ai_auto_processor.system_prompt',
+                                      'ai_auto_processor.prompts', 'ai_auto_processor.align_subtitles',
+                                      'ai_auto_processor.chunking'),
+        'code': ['ai_auto_processor.py', 'segment_aligner.py', 'subtitle_timeline.py', 'report_writer.py',
+                 'llm_dispatcher.py', 'llm_stream.py']
+    },
+    {
+        'name': 'combine',
+        'description': '报告合并',
+        'targets': combine_targets,
+        'run': run_combine,
+        'params': lambda config: {},
+        'code': ['combine_reports(内容合并工具).py']
+    },
+    {
+        'name': 'script',
+        'description': '剪辑脚本',
+        'targets': script_targets,
+        'run': run_script,
+        'params': lambda config: pick(config, 'ai_auto_processor.model', 'pipeline.script_request',
+                                      'corpus_compaction'),
+        'code': ['mad_script_generator(ai生成剪辑脚本).py', 'llm_stream.py', 'corpus_compactor.py']
+    },
+    {
+        'name': 'cut',
+        'description': '视频切割',
+        'targets': cut_targets,
+        'run': run_cut,
+        'params': lambda config: {},
+        'code': ['auto_cut_video(视频切割).py']
+    },
+    {
+        'name': 'merge',
+        'description': '视频合并',
+        'targets': merge_targets,
+        'run': run_merge,
+        'params': lambda config: {},
+        'code': ['video_merger.py']
+    },
+]
+
+# ---------- 调度 ----------
+
+def target_signature(stage, target, config):
+    """由输入文件内容、阶段参数和代码版本计算目标签名"""
+    payload = {
+        'inputs': {path: file_hash(path) for path in target['inputs']},
+        'params': stage['params'](config),
+        'code': {name: file_hash(os.path.join(SRC_DIR, name)) for name in stage['code']}
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+def output_hashes(target):
+    return {path: file_hash(path) for path in expand(target['outputs'])}
+
+def stale_reason(record, signature, target):
+    """返回目标需要重新运行的原因，无需运行时返回None"""
+    if record is None:
+        return '首次运行'
+    if record['signature'] != signature:
+        return '输入、参数或代码已变化'
+    outputs = output_hashes(target)
+    if not outputs or any(not expand([pattern]) for pattern in target['outputs']):
+        return '输出缺失'
+    if outputs != record['outputs']:
+        return '输出被修改'
+    return None
+
+def remove_outputs(target):
+    """重新生成前删除旧输出(FFmpeg遇到已存在的文件会等待确认)"""
+    for path in expand(target['outputs']):
+        os.remove(path)
+
+def run_pipeline(stages=None, force=(), dry_run=False, config=None):
+    """按阶段图执行流水线，只重新运行输入、参数或代码发生变化的目标"""
+    if config is None:
+        with open('src/config.json', 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    state = _load_json(STATE_PATH)
+    selected = [s for s in STAGES if stages is None or s['name'] in stages]
+
+    for stage in selected:
+        print(f"\n=== 阶段 {stage['name']}({stage['description']}) ===")
+        targets = stage['targets'](config)
+        stage_state = state.setdefault(stage['name'], {})
+        stale = []
+        for target in targets:
+            signature = target_signature(stage, target, config)
+            reason = '强制运行' if stage['name'] in force else stale_reason(stage_state.get(target['name']),
+                                                                          signature, target)
+            if reason:
+                print(f"  运行 {target['name']}: {reason}")
+                stale.append((target, signature))
+            else:
+                print(f"  跳过 {target['name']}: 未变化")
+        save_hash_cache()
+        if not stale or dry_run:
+            continue
+
+        for target, _ in stale:
+            remove_outputs(target)
+        try:
+            stage['run'](config, [target for target, _ in stale])
+        finally:
+            # 只记录输出已生成的目标，失败的目标下次继续运行
+            for target, signature in stale:
+                outputs = output_hashes(target)
+                if outputs and all(expand([pattern]) for pattern in target['outputs']):
+                    stage_state[target['name']] = {'signature': signature, 'outputs': outputs}
+                else:
+                    stage_state.pop(target['name'], None)
+                    print(f"  警告: {target['name']} 未生成全部输出")
+            save_hash_cache()
+            _save_json(STATE_PATH, state)
+
+    if dry_run:
+        return
+    load_module('llm_cache').print_cache_stats(config)
+    meter = load_module('usage_meter').load_usage_meter(config)
+    if meter is not None:
+        meter.write_summary()
+
+if __name__ == '__main__':
+    names = [s['name'] for s in STAGES]
+    parser = argparse.ArgumentParser(description="按阶段图运行完整流程，跳过输入未变化的阶段")
+    parser.add_argument('--stages', nargs='+', choices=names, help="只运行指定阶段(默认全部)")
+    parser.add_argument('--force', nargs='+', choices=names, default=[], help="强制重新运行的阶段")
+    parser.add_argument('--dry-run', action='store_true', help="只显示各阶段是否需要运行")
+    args = parser.parse_args()
+    run_pipeline(args.stages, args.force, args.dry_run)
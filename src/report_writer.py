@@ -0,0 +1,68 @@
+import os
+import time
+
+def format_timestamp(seconds):
+    """将秒数格式化为HH:MM:SS.mmm"""
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+class ReportWriter:
+    """增量写入视频分析报告(output/视频名/report.txt)
+
+    分析过程中只向report.txt.partial追加新行，乱序完成的组先暂存，
+    凑成连续序号后再按顺序写出；每隔flush_interval秒刷盘一次，
+    finalize时原子替换为正式报告。每组的写入开销与视频长度无关
+    """
+
+    def __init__(self, video_name, output_root='output', flush_interval=5.0):
+        video_name_base = os.path.splitext(video_name)[0]
+        output_dir = os.path.join(output_root, video_name_base)
+        os.makedirs(output_dir, exist_ok=True)
+        self.report_path = os.path.join(output_dir, 'report.txt')
+        self.partial_path = self.report_path + '.partial'
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._file = open(self.partial_path, 'w', encoding='utf-8')
+        self._file.write(f"## {video_name_base}\n")
+        self._file.write("| 时间段 | 内容概述 |\n")
+        self._file.write("|--------|----------|\n")
+
+    def add(self, group_idx, start_seconds, end_seconds, desc):
+        """添加一组分析结果，group_idx从0开始"""
+        self._pending[group_idx] = (start_seconds, end_seconds, desc)
+        while self.rows_written in self._pending:
+            self._write_row(*self._pending.pop(self.rows_written))
+            self.rows_written += 1
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _write_row(self, start_seconds, end_seconds, desc):
+        time_range = f"{format_timestamp(start_seconds)}-{format_timestamp(end_seconds)}"
+        self._file.write(f"| {time_range} | {desc} |\n")
+
+    def flush(self):
+        """把已写出的行刷到磁盘"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def finalize(self):
+        """写出剩余行并原子替换为正式报告，返回报告路径"""
+        for group_idx in sorted(self._pending):
+            self._write_row(*self._pending[group_idx])
+        self._pending.clear()
+        self.flush()
+        self._file.close()
+        os.replace(self.partial_path, self.report_path)
+        return self.report_path
+
+    def close(self):
+        """中途失败时关闭文件，保留.partial中已完成的内容"""
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
@@ -0,0 +1,134 @@
+import os
+import re
+import bisect
+import json
+
+from subtitle_timeline import SubtitleTimeline
+from report_writer import format_timestamp
+
+# 报告行: | 00:01:15.000-00:01:30.500 | 描述 |，兼容不带毫秒的时间
+REPORT_ROW = re.compile(
+    r'^\|\s*(\d{1,2}:\d{2}:\d{2}(?:\.\d+)?)\s*-\s*(\d{1,2}:\d{2}:\d{2}(?:\.\d+)?)\s*\|\s*(.*?)\s*\|\s*$'
+)
+
+ALIGNED_FILENAME = 'aligned_segments.json'
+
+SPECIAL_TAGS = {'op': 'OP', 'ed': 'ED'}
+
+def parse_timecode(value):
+    """解析HH:MM:SS(.mmm)为秒"""
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def format_timecode(seconds):
+    """把秒格式化为HH:MM:SS.mmm(与关键帧分析报告的时间段格式一致)，保留毫秒以免短镜头的时间段首尾相同"""
+    return format_timestamp(seconds)
+
+def parse_report_rows(report_path):
+    """读取关键帧分析报告中的表格行，返回[{'start', 'end', 'desc'}]，时间为秒"""
+    rows = []
+    with open(report_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            match = REPORT_ROW.match(line.strip())
+            if match:
+                start, end, desc = match.groups()
+                rows.append({'start': parse_timecode(start), 'end': parse_timecode(end), 'desc': desc})
+    rows.sort(key=lambda r: r['start'])
+    return rows
+
+def align_segments(rows, timeline, line_kinds=('dialogue', 'lyric', 'insert')):
+    """把每个分析片段与时间上重叠的字幕行连接，返回紧凑的片段记录
+
+    跨越片段边界的台词只归入其中点所在的片段，避免重复；
+    与OP/ED重叠的片段打上标记，插入曲片段标注曲名
+    """
+    starts = [int(row['start'] * 1000) for row in rows]
+    records = []
+    for idx, row in enumerate(rows):
+        start_ms = starts[idx]
+        end_ms = max(start_ms + 1, int(row['end'] * 1000))
+        lines = []
+        tags = []
+        for event in timeline.overlapping(start_ms, end_ms):
+            if event.kind in SPECIAL_TAGS:
+                tag = SPECIAL_TAGS[event.kind]
+                if tag not in tags:
+                    tags.append(tag)
+                continue
+            if event.kind == 'insert' and f"插入曲「{event.song}」" not in tags:
+                tags.append(f"插入曲「{event.song}」")
+            if event.kind not in line_kinds or not event.text:
+                continue
+            # 中点落在哪个片段就归哪个片段；首尾片段收下超出范围的台词
+            midpoint = (event.start + event.end) // 2
+            owner = max(0, bisect.bisect_right(starts, midpoint) - 1)
+            if owner == idx and (not lines or lines[-1] != event.text):
+                lines.append(event.text)
+        records.append({
+            'start': row['start'],
+            'end': row['end'],
+            'desc': row['desc'],
+            'lines': lines,
+            'tags': tags
+        })
+    return records
+
+def format_record(record):
+    """一个片段一行: [时间段][标记] 画面描述 | 台词: a / b"""
+    text = f"[{format_timecode(record['start'])}-{format_timecode(record['end'])}]"
+    for tag in record['tags']:
+        text += f"[{tag}]"
+    text += f" {record['desc']}"
+    if record['lines']:
+        text += " | 台词: " + " / ".join(line.replace('\\N', ' ') for line in record['lines'])
+    return text
+
+def split_windows(records, window_seconds, min_fraction=0.25):
+    """按时间把片段记录切分为约window_seconds秒的窗口，片段不会被拆开
+
+    最后一个窗口短于window_seconds × min_fraction时并入前一个窗口
+    """
+    windows = []
+    for record in records:
+        if not windows or record['start'] >= windows[-1][0]['start'] + window_seconds:
+            windows.append([])
+        windows[-1].append(record)
+    if len(windows) > 1:
+        last = windows[-1]
+        if last[-1]['end'] - last[0]['start'] < window_seconds * min_fraction:
+            windows[-2].extend(windows.pop())
+    return windows
+
+def format_aligned_content(video_name, records, part=None):
+    """把对齐后的片段整理为发送给大模型的紧凑文本
+
+    part为(序号, 总数)时表示这是分段请求中的一段，提示大模型只输出本段的表格行
+    """
+    lines = [f"【{video_name}】"]
+    if part is not None:
+        lines.append(f"（第 {part[0]}/{part[1]} 部分，时间范围 {format_timecode(records[0]['start'])}"
+                     f"-{format_timecode(records[-1]['end'])}，只输出这一部分的表格行，时间段不要超出该范围）")
+    lines.append("以下每行是一个镜头片段：[时间段][OP/ED/插入曲标记] 画面描述 | 该时间段内的台词")
+    lines.extend(format_record(record) for record in records)
+    return "\n".join(lines)
+
+def find_subtitle_timeline(folder):
+    """查找分析文件夹中的字幕时间轴(视频名_subtitles.json)"""
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('_subtitles.json'):
+            return os.path.join(folder, name)
+    return None
+
+def build_aligned_segments(folder):
+    """对齐分析文件夹中的报告与字幕，保存aligned_segments.json并返回片段记录
+
+    文件夹缺少report.txt或字幕时间轴时返回None
+    """
+    report_path = os.path.join(folder, 'report.txt')
+    timeline_path = find_subtitle_timeline(folder)
+    if not os.path.exists(report_path) or timeline_path is None:
+        return None
+    records = align_segments(parse_report_rows(report_path), SubtitleTimeline.load(timeline_path))
+    with open(os.path.join(folder, ALIGNED_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    return records
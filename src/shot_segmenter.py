@@ -0,0 +1,33 @@
+from frame_filter import frame_signature, hamming_distance
+
+def frame_start(frame):
+    """帧覆盖的起始时间：经过帧筛选时取其合并范围的起点，否则取自身时间戳"""
+    return frame.get('start', frame.get('pts'))
+
+def segment_shots(frames, shot_distance=20, min_frames=3, max_frames=5, duration=None):
+    """按镜头边界把关键帧分组，并给每组标注真实起止时间
+
+    相邻帧感知哈希差异超过shot_distance视为镜头切换。组在镜头切换处结束，
+    但帧数不足min_frames时继续并入后续短镜头；长镜头按max_frames拆分。
+    产出 {'index', 'frames', 'start', 'end'}，end为下一组的开始时间，
+    最后一组的end为duration(未提供时取最后一帧的时间)
+    """
+    group = []
+    index = 0
+    prev_hash = None
+    for frame in frames:
+        dhash = frame.get('dhash')
+        if dhash is None:
+            dhash = frame_signature(frame['image'])[0]
+        boundary = prev_hash is not None and hamming_distance(dhash, prev_hash) > shot_distance
+        prev_hash = dhash
+
+        if group and ((boundary and len(group) >= min_frames) or len(group) >= max_frames):
+            yield {'index': index, 'frames': group, 'start': frame_start(group[0]), 'end': frame_start(frame)}
+            index += 1
+            group = []
+        group.append(frame)
+
+    if group:
+        end = duration if duration is not None else group[-1].get('pts')
+        yield {'index': index, 'frames': group, 'start': frame_start(group[0]), 'end': end}
@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+from collections import namedtuple
+
+CACHE_DIR = os.path.join('cache', 'subtitles')
+
+# 时间均为毫秒整数；song只对插入曲有值
+SubtitleEvent = namedtuple('SubtitleEvent', ['start', 'end', 'style', 'kind', 'text', 'song'])
+
+STYLE_KINDS = {
+    'Dial_CH': 'dialogue',
+    'Lyric_CH': 'lyric',
+    'Title': 'title',
+    'Staff': 'title',
+    'OP_CH': 'op',
+    'ED_CH': 'ed',
+}
+
+ASS_TIME = re.compile(r'^(\d+):(\d{1,2}):(\d{1,2})(?:\.(\d{1,3}))?$')
+
+def parse_ass_time(value):
+    """解析ASS时间"0:01:02.34"为毫秒"""
+    match = ASS_TIME.match(value.strip())
+    if not match:
+        raise ValueError(f"无效的ASS时间: {value}")
+    hours, minutes, seconds, fraction = match.groups()
+    fraction = (fraction or '0').ljust(3, '0')
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(fraction)
+
+def format_ass_time(ms):
+    """把毫秒格式化为ASS时间"0:01:02.34"(厘秒精度)"""
+    centis = int(round(ms / 10))
+    seconds, centis = divmod(centis, 100)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centis:02d}"
+
+def style_kind(style):
+    """按样式名归类字幕: dialogue/lyric/title/op/ed/insert/other"""
+    if style.startswith('IN_'):
+        return 'insert'
+    return STYLE_KINDS.get(style, 'other')
+
+def parse_ass(ass_path):
+    """读取.ass文件的[Events]段，返回按出现顺序排列的SubtitleEvent列表"""
+    events = []
+    current_song = None
+    with open(ass_path, 'r', encoding='utf-8') as f:
+        in_events = False
+        for line in f:
+            line = line.strip()
+            if line.startswith('[Events]'):
+                in_events = True
+                continue
+            if not in_events:
+                continue
+
+            if line.startswith('Comment:') and 'IN「' in line:
+                # 插入曲标记，之后的IN_样式字幕归到这首歌
+                current_song = line.split('IN「')[1].split('」')[0]
+
+            if line.startswith('Dialogue:'):
+                parts = line.split(',', 9)
+                if len(parts) < 10:
+                    continue
+                try:
+                    start = parse_ass_time(parts[1])
+                    end = parse_ass_time(parts[2])
+                except ValueError:
+                    continue
+                style = parts[3].strip()
+                # 去除所有特效标签
+                text = re.sub(r'\{.*?\}', '', parts[9].strip())
+                kind = style_kind(style)
+                song = (current_song or "未命名插入曲") if kind == 'insert' else None
+                events.append(SubtitleEvent(start, end, style, kind, text, song))
+    return events
+
+class SubtitleTimeline:
+    """按时间索引的字幕事件集合
+
+    事件按开始时间排序，并在其上建一棵记录区间最大结束时间的线段树：
+    重叠查询为O(log n + k·log n)，最近查询为O(log n)
+    """
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda e: (e.start, e.end))
+        self._starts = [e.start for e in self.events]
+        # 前缀最大结束时间对应的事件下标，用于最近查询
+        self._prefix_last = []
+        best = None
+        for i, event in enumerate(self.events):
+            if best is None or event.end >= self.events[best].end:
+                best = i
+            self._prefix_last.append(best)
+        self._size = 1
+        while self._size < len(self.events):
+            self._size *= 2
+        self._max_end = [-1] * (2 * self._size)
+        for i, event in enumerate(self.events):
+            self._max_end[self._size + i] = event.end
+        for node in range(self._size - 1, 0, -1):
+            self._max_end[node] = max(self._max_end[2 * node], self._max_end[2 * node + 1])
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def _collect(self, node, lo, hi, limit, after, out):
+        """在下标[lo, hi)∩[0, limit)中收集end > after的事件下标"""
+        if lo >= limit or self._max_end[node] <= after:
+            return
+        if hi - lo == 1:
+            out.append(lo)
+            return
+        mid = (lo + hi) // 2
+        self._collect(2 * node, lo, mid, limit, after, out)
+        self._collect(2 * node + 1, mid, hi, limit, after, out)
+
+    def overlapping(self, start, end, kinds=None):
+        """返回与[start, end](毫秒)有重叠的事件，按开始时间排序；kinds限定字幕类别"""
+        if not self.events:
+            return []
+        # 单点查询时包含恰好在该时刻开始的事件
+        limit = bisect.bisect_right(self._starts, end) if end == start else bisect.bisect_left(self._starts, end)
+        indices = []
+        self._collect(1, 0, self._size, limit, start if end > start else start - 1, indices)
+        events = [self.events[i] for i in indices]
+        if kinds is not None:
+            events = [e for e in events if e.kind in kinds]
+        return events
+
+    def at(self, ms, kinds=None):
+        """返回ms时刻正在显示的事件"""
+        return self.overlapping(ms, ms, kinds)
+
+    def nearest(self, ms):
+        """返回离ms最近的事件及距离(毫秒)，正在显示的事件距离为0；没有事件时返回(None, None)"""
+        if not self.events:
+            return None, None
+        current = self.at(ms)
+        if current:
+            return current[0], 0
+        idx = bisect.bisect_right(self._starts, ms)
+        candidates = []
+        if idx > 0:
+            before = self.events[self._prefix_last[idx - 1]]
+            candidates.append((ms - before.end, before))
+        if idx < len(self.events):
+            after = self.events[idx]
+            candidates.append((after.start - ms, after))
+        distance, event = min(candidates, key=lambda c: c[0])
+        return event, distance
+
+    def filter(self, kinds):
+        """只保留指定类别的事件，返回新的时间轴"""
+        return SubtitleTimeline([e for e in self.events if e.kind in kinds])
+
+    def to_dict(self):
+        return {'events': [list(e) for e in self.events]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls([SubtitleEvent(*e) for e in data['events']])
+
+    def save(self, path):
+        """保存为JSON(先写临时文件再替换)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+def load_timeline(ass_path, cache_dir=CACHE_DIR):
+    """读取字幕时间轴；按(路径, 大小, 修改时间)缓存解析结果，每集只解析一次"""
+    path = os.path.abspath(ass_path)
+    stat = os.stat(path)
+    key = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('size') == stat.st_size and data.get('mtime_ns') == stat.st_mtime_ns:
+                return SubtitleTimeline.from_dict(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            print(f"警告: 字幕缓存 {cache_path} 损坏，重新解析")
+    timeline = SubtitleTimeline(parse_ass(path))
+    data = timeline.to_dict()
+    data.update({'source': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    return timeline
+
+def render_subtitle_text(events):
+    """按原有的字幕文本格式输出: 普通对话 + 特殊字幕(OP/ED合并、插入曲按曲目分组)"""
+    normal_lines = []
+    special_lines = []
+    last_entries = {}  # 存储最后出现的OP/ED条目
+    in_songs = {}      # 存储插入曲 {曲名: [(start, end, text), ...]}
+
+    for event in events:
+        start, end = format_ass_time(event.start), format_ass_time(event.end)
+        if event.kind == 'insert':
+            in_songs.setdefault(event.song, []).append((start, end, event.text))
+        elif event.kind in ('op', 'ed'):
+            if event.text in last_entries:
+                # 同一样式的相同文本合并时间范围
+                last_start, last_end, last_style = last_entries[event.text]
+                if event.style == last_style:
+                    last_entries[event.text] = (last_start, end, event.style)
+                    continue
+            last_entries[event.text] = (start, end, event.style)
+        elif event.kind == 'dialogue':
+            normal_lines.append(f"{start} --> {end}：{event.text}")
+        elif event.kind == 'lyric':
+            special_lines.append(f"{start} --> {end} [歌词]：{event.text}")
+        elif event.kind == 'title':
+            special_lines.append(f"{start} --> {end} [标题/制作]：{event.text}")
+
+    for text, (start, end, style) in last_entries.items():
+        if style == 'OP_CH':
+            special_lines.append(f"{start} --> {end} [OP]：{text}")
+        elif style == 'ED_CH':
+            special_lines.append(f"{start} --> {end} [ED]：{text}")
+
+    if in_songs:
+        special_lines.append("\n插入曲：")
+        for song_name, lyrics in in_songs.items():
+            special_lines.append(f"\n【{song_name}】")
+            for start, end, text in lyrics:
+                special_lines.append(f"{start} --> {end}：{text}")
+
+    return "普通对话：\n" + "\n".join(normal_lines) + "\n\n特殊字幕：\n" + "\n".join(special_lines)
@@ -0,0 +1,158 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+CALLS_FILENAME = 'calls.jsonl'
+SUMMARY_FILENAME = 'summary.json'
+
+# 汇总时累加的字段
+SUM_FIELDS = ('prompt_tokens', 'completion_tokens', 'images', 'queue_wait_seconds', 'latency_seconds',
+              'server_seconds', 'cost')
+
+class UsageRecorder:
+    """绑定了阶段和集名的记录器，传给analyze_frames、调度器等调用点"""
+
+    def __init__(self, meter, stage, episode=None):
+        self.meter = meter
+        self.stage = stage
+        self.episode = episode
+
+    def record(self, model, **metrics):
+        self.meter.record(self.stage, model, episode=self.episode, **metrics)
+
+class UsageMeter:
+    """模型调用的token、耗时与费用记录
+
+    每次调用追加一行到usage/calls.jsonl(多个进程可同时追加)；write_summary()汇总全部记录，
+    按阶段、按集和按运行写入usage/summary.json。
+    queue_wait为请求发出前及在服务端排队的时间，latency为请求往返时间，
+    server_seconds为服务端报告的处理时间(Ollama的total_duration)
+    """
+
+    def __init__(self, directory='usage', prices=None, currency='CNY'):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prices = prices or {}
+        self.currency = currency
+        self.run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+        self._lock = threading.Lock()
+
+    @property
+    def calls_path(self):
+        return os.path.join(self.directory, CALLS_FILENAME)
+
+    @property
+    def summary_path(self):
+        return os.path.join(self.directory, SUMMARY_FILENAME)
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        """按每百万token单价估算费用，未配置单价的模型(如本地Ollama模型)计为0"""
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        return (prompt_tokens * price.get('input', 0) + completion_tokens * price.get('output', 0)) / 1e6
+
+    def recorder(self, stage, episode=None):
+        return UsageRecorder(self, stage, episode)
+
+    def record(self, stage, model, episode=None, prompt_tokens=0, completion_tokens=0, images=0,
+               queue_wait=0.0, latency=0.0, server_seconds=None, cached=False, **extra):
+        """记录一次调用；cached为True表示命中缓存、未请求模型"""
+        call = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'run': self.run_id,
+            'stage': stage,
+            'episode': episode,
+            'model': model,
+            'cached': cached,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'images': images,
+            'queue_wait_seconds': round(queue_wait, 4),
+            'latency_seconds': round(latency, 4),
+            'server_seconds': round(server_seconds, 4) if server_seconds is not None else None,
+            'cost': round(self.cost(model, prompt_tokens, completion_tokens), 6)
+        }
+        call.update(extra)
+        with self._lock:
+            with open(self.calls_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(call, ensure_ascii=False) + '\n')
+
+    def load_calls(self):
+        calls = []
+        if not os.path.exists(self.calls_path):
+            return calls
+        with open(self.calls_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    calls.append(json.loads(line))
+                except ValueError:
+                    # 其他进程写到一半的行
+                    continue
+        return calls
+
+    def write_summary(self):
+        """汇总全部调用记录写入summary.json，打印本次运行的概况并返回汇总"""
+        calls = self.load_calls()
+        summary = {
+            'updated': datetime.now().isoformat(timespec='seconds'),
+            'currency': self.currency,
+            'total': aggregate(calls),
+            'stages': group_by(calls, 'stage'),
+            'episodes': {episode: group_by(items, 'stage')
+                         for episode, items in split_by(calls, 'episode').items() if episode},
+            'runs': {run: {'stages': group_by(items, 'stage'), 'total': aggregate(items)}
+                     for run, items in split_by(calls, 'run').items()}
+        }
+        tmp_path = self.summary_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.summary_path)
+
+        run = summary['runs'].get(self.run_id)
+        if run:
+            print(f"\n本次模型调用统计(详见 {self.summary_path}):")
+            for stage, stats in run['stages'].items():
+                print(f"  {stage}: {stats['calls']} 次(缓存 {stats['cached']} 次), "
+                      f"输入 {stats['prompt_tokens']} / 输出 {stats['completion_tokens']} tokens, "
+                      f"请求耗时 {stats['latency_seconds']:.1f}s, 排队 {stats['queue_wait_seconds']:.1f}s, "
+                      f"费用约 {stats['cost']:.4f} {self.currency}")
+        return summary
+
+def aggregate(calls):
+    """累加一组调用的用量"""
+    totals = {'calls': len(calls), 'cached': sum(1 for c in calls if c.get('cached'))}
+    for field in SUM_FIELDS:
+        totals[field] = round(sum(c.get(field) or 0 for c in calls), 6)
+    requested = totals['calls'] - totals['cached']
+    totals['avg_latency_seconds'] = round(totals['latency_seconds'] / requested, 4) if requested else 0.0
+    return totals
+
+def split_by(calls, field):
+    groups = {}
+    for call in calls:
+        groups.setdefault(call.get(field), []).append(call)
+    return groups
+
+def group_by(calls, field):
+    return {key: aggregate(items) for key, items in split_by(calls, field).items()}
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def load_usage_meter(config):
+    """按config.json中的usage配置返回记录器，未启用时返回None；同一目录在进程内共用一个实例"""
+    usage_config = config.get('usage', {})
+    if not usage_config.get('enabled', True):
+        return None
+    directory = usage_config.get('dir', 'usage')
+    with _shared_lock:
+        meter = _shared.get(directory)
+        if meter is None:
+            meter = _shared[directory] = UsageMeter(
+                directory=directory,
+                prices=usage_config.get('prices', {}),
+                currency=usage_config.get('currency', 'CNY')
+            )
+        return meter
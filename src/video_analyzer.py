@@ -1,43 +1,52 @@
 import os
+import io
 import json
 import time
-import subprocess
 import threading
-from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import argparse
 from tqdm import tqdm
-import ollama
-from httpx import ConnectError
 from PIL import Image
-import re
+import media_probe
+import ollama_client
+import vlm_router
+from keyframe_stream import stream_keyframes
+from frame_cache import load_frame_cache
+from frame_filter import filter_frames
+from shot_segmenter import segment_shots
+from report_writer import ReportWriter, format_timestamp
+from image_prep import prepare_images, adapt_prompt
+from subtitle_timeline import load_timeline, render_subtitle_text
+from analysis_journal import AnalysisJournal, make_fingerprint, JOURNAL_FILENAME
+from usage_meter import load_usage_meter
+from llm_cache import print_cache_stats
 
 def get_video_fps(video_path):
-    """使用FFmpeg获取视频实际帧率"""
-    cmd = [
-        'ffprobe',
-        '-v', 'error',
-        '-select_streams', 'v:0',
-        '-show_entries', 'stream=r_frame_rate',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    num, denom = map(int, result.stdout.strip().split('/'))
-    return num / denom
+    """获取视频实际帧率"""
+    return media_probe.get_frame_rate(video_path)
 
-def process_subtitles(video_path):
-    """处理字幕文件并生成文本记录(改进版)"""
-    # 获取视频所在目录
-    video_dir = os.path.dirname(video_path)
-    # 查找目录下的第一个.ass文件
-    ass_files = [f for f in os.listdir(video_dir) if f.endswith('.ass')]
-    
+def process_subtitles(video_path, subtitle_path=None, output_root='output'):
+    """处理字幕文件并生成文本记录(改进版)
+
+    subtitle_path指定字幕文件(.ass或.txt)；未指定时使用视频目录下的第一个.ass文件
+    """
     # 创建固定名称的输出文件夹
     video_name = os.path.splitext(os.path.basename(video_path))[0]
-    output_dir = os.path.join('output', video_name)
+    output_dir = os.path.join(output_root, video_name)
     os.makedirs(output_dir, exist_ok=True)
     txt_path = os.path.join(output_dir, f"{video_name}_subtitles.txt")
 
+    if subtitle_path is not None:
+        if subtitle_path.lower().endswith('.txt'):
+            import shutil
+            shutil.copy2(subtitle_path, txt_path)
+            return txt_path
+        ass_files = [subtitle_path]
+    else:
+        # 查找视频所在目录下的第一个.ass文件
+        video_dir = os.path.dirname(video_path)
+        ass_files = [os.path.join(video_dir, f) for f in os.listdir(video_dir) if f.endswith('.ass')]
+
     if not ass_files:
         print(f"\n警告: 未在视频目录中找到字幕文件(.ass)")
         while True:
@@ -69,179 +78,74 @@ def process_subtitles(video_path):
             print(f"已复制字幕文件到: {txt_path}")
             return txt_path
     
-    ass_path = os.path.join(video_dir, ass_files[0])
-    
+    ass_path = ass_files[0]
+    timeline = load_timeline(ass_path)
+    # 保存带索引的时间轴，供后续对齐、报告和剪辑按时间查询台词
+    timeline.save(os.path.join(output_dir, f"{video_name}_subtitles.json"))
 
-    normal_lines = []
-    special_lines = []
-    last_entries = {}  # 存储最后出现的字幕条目
-    in_songs = {}      # 存储插入曲 {曲名: [(start, end, text), ...]}
-    current_song = None
-    
-    with open(ass_path, 'r', encoding='utf-8') as f:
-        in_events = False
-        for line in f:
-            line = line.strip()
-            if line.startswith('[Events]'):
-                in_events = True
-                continue
-            if not in_events:
-                continue
-                
-            if line.startswith('Comment:') and 'IN「' in line:
-                # 处理插入曲标记
-                song_name = line.split('IN「')[1].split('」')[0]
-                current_song = song_name
-                if song_name not in in_songs:
-                    in_songs[song_name] = []
-            
-            if line.startswith('Dialogue:'):
-                parts = line.split(',', 9)
-                if len(parts) < 10:
-                    continue
-                    
-                start = parts[1].strip()
-                end = parts[2].strip()
-                style = parts[3].strip()
-                text = parts[9].strip()
-                
-                # 去除所有特效标签
-                text = re.sub(r'\{.*?\}', '', text)
-                
-                # 处理插入曲
-                if style.startswith('IN_'):
-                    if current_song:
-                        in_songs[current_song].append((start, end, text))
-                    else:
-                        in_songs.setdefault("未命名插入曲", []).append((start, end, text))
-                # 对于特效字幕(OP/ED)，检查是否与前一条目文本相同
-                elif style in ['OP_CH', 'ED_CH']:
-                    if text in last_entries:
-                        # 合并时间范围，更新结束时间
-                        last_start, last_end, last_style = last_entries[text]
-                        if style == last_style:
-                            last_entries[text] = (last_start, end, style)
-                            continue
-                    
-                    # 新条目或不同样式，保存当前条目
-                    last_entries[text] = (start, end, style)
-                else:
-                    # 普通对话直接添加
-                    if style in ['Dial_CH']:
-                        normal_lines.append(f"{start} --> {end}：{text}")
-                    elif style in ['Lyric_CH']:
-                        special_lines.append(f"{start} --> {end} [歌词]：{text}")
-                    elif style in ['Title', 'Staff']:
-                        special_lines.append(f"{start} --> {end} [标题/制作]：{text}")
-    
-    # 添加合并后的特效字幕
-    for text, (start, end, style) in last_entries.items():
-        if style == 'OP_CH':
-            special_lines.append(f"{start} --> {end} [OP]：{text}")
-        elif style == 'ED_CH':
-            special_lines.append(f"{start} --> {end} [ED]：{text}")
-    
-    # 添加插入曲内容
-    if in_songs:
-        special_lines.append("\n插入曲：")
-        for song_name, lyrics in in_songs.items():
-            special_lines.append(f"\n【{song_name}】")
-            for start, end, text in lyrics:
-                special_lines.append(f"{start} --> {end}：{text}")
-    
     with open(txt_path, 'w', encoding='utf-8') as f:
-        f.write("普通对话：\n")
-        f.write("\n".join(normal_lines))
-        f.write("\n\n特殊字幕：\n")
-        f.write("\n".join(special_lines))
+        f.write(render_subtitle_text(timeline))
     
     return txt_path
 
-def monitor_frames(output_dir):
-    """监控并单行实时显示最新帧文件"""
-    last_frame = None
-    while True:
-        if os.path.exists(output_dir):
-            frames = [f for f in os.listdir(output_dir) if f.startswith('frame_')]
-            if frames:
-                latest = sorted(frames)[-1]
-                if latest != last_frame:
-                    print(f"\r最新关键帧: {os.path.join(output_dir, latest)}", end="", flush=True)
-                    last_frame = latest
+def format_extraction_progress(event):
+    """将关键帧提取进度事件格式化为单行文本"""
+    text = f"关键帧 {event['frame']}"
+    if event['position'] is not None:
+        text += f" | 位置 {format_timestamp(event['position'])}"
+        if event['duration']:
+            text += f"/{format_timestamp(event['duration'])}"
+    if event['speed']:
+        text += f" | 速度 {event['speed']:.2f}x"
+    if event['eta'] is not None:
+        text += f" | 剩余 {format_timestamp(event['eta'])}"
+    return text
 
-def extract_keyframes(video_path, output_dir, interval=5):
-    """提取视频关键帧(使用GPU加速)"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 先处理字幕并确保完成
-    subtitle_file = process_subtitles(video_path)
-    if subtitle_file:
-        print(f"已生成字幕文件: {subtitle_file}")
-        # 确保字幕文件已完全写入
+def check_ollama_connection(host='http://localhost:11434'):
+    """获取共享的Ollama会话(连接在首次推理时建立并复用)"""
+    return ollama_client.get_session(host)
 
+def analyze_frames(frame_paths, model_name=None, prompt=None, cache=None, image_prep=None, session=None,
+                   usage=None):
+    """使用ollama分析多帧图像(优化GPU版本)，帧可以是文件路径或内存中的图像字节
     
-    # 启动监控线程
-    monitor_thread = threading.Thread(
-        target=monitor_frames,
-        args=(output_dir,),
-        daemon=True
-    )
-    monitor_thread.start()
-    
-    cmd = [
-        'ffmpeg',
-        '-hwaccel', 'auto',
-        '-hwaccel_device', '1',
-        '-loglevel', 'error',
-        '-i', video_path,
-        '-vf', f"select='eq(pict_type,I)',scale=360:-1",
-        '-vsync', 'vfr',
-        '-q:v', '2',
-        '-stats',
-        os.path.join(output_dir, 'frame_%04d.jpg')
-    ]
-    
-    print("使用显卡加速模式...")
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    if result.returncode != 0:
-        raise RuntimeError("显卡加速失败，请检查显卡驱动和FFmpeg配置")
-    
-    # 获取最新关键帧文件名
-    frames = sorted([f for f in os.listdir(output_dir) if f.startswith('frame_')])
-    if frames:
-        latest_frame = os.path.join(output_dir, frames[-1])
-        print(f"\n检测到最新关键帧文件: {latest_frame}\n", flush=True)  # 强制刷新输出
-        return latest_frame
-    print("警告: 未在临时目录中找到任何关键帧文件")
-    return None
-
-def check_ollama_connection():
-    """检查Ollama服务连接"""
-    client = ollama.Client(host='http://localhost:11434')
-    max_retries = 3
-    for i in range(max_retries):
-        client.list()  # 简单API调用测试连接
-        return client
-
-def analyze_frames(frame_paths, model_name=None, prompt=None):
-    """使用ollama分析多帧图像(优化GPU版本)"""
-    # 验证所有图片有效性
-    for frame_path in frame_paths:
-        with Image.open(frame_path) as img:
-            img.verify()
-    
-    client = check_ollama_connection()
-    
+    传入cache(FrameDescriptionCache)时，相同图像+模型+提示词+参数的组直接返回缓存结果；
+    image_prep为image_prep.prepare_images的参数字典，决定图像在内存中缩放还是拼成一张图；
+    session为共享的OllamaSession，未传入时使用本机默认地址的会话；
+    usage(UsageRecorder)记录每次请求的token数、图像数、排队时间和服务端耗时
+    """
     if prompt is None:
         prompt = "这是5张连续的动漫视频截图，请尽可能简略描述这个片段的内容，必须使用中文返回结果，描述时请专注于画面中人物，环境，动作，忽略文字信息，保持简洁"
     
     if model_name is None:
         model_name = "llava"
+    
+    if image_prep is None:
+        image_prep = {'mode': 'original'}
+    prompt = adapt_prompt(prompt, image_prep.get('mode', 'original'))
         
-    # 简化参数设置
-    options = {
-        'num_thread': 2
-    }
+    if session is None:
+        session = check_ollama_connection()
+    # 线程数只影响速度不影响输出，不参与缓存键
+    options = {key: value for key, value in session.options.items() if key != 'num_thread'}
+    
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(frame_paths, model_name, prompt, {'options': options, 'image_prep': image_prep})
+        cached = cache.get(cache_key)
+        if cached is not None:
+            if usage is not None:
+                usage.record(model_name, images=len(frame_paths), cached=True)
+            return cached
+    
+    if image_prep.get('mode', 'original') != 'tile':
+        # 验证所有图片有效性(原样发送的帧不会被解码)
+        for frame_path in frame_paths:
+            source = io.BytesIO(frame_path) if isinstance(frame_path, bytes) else frame_path
+            with Image.open(source) as img:
+                img.verify()
+    # 拼图时图像已在内存中完整解码，无需单独验证
+    frame_paths = prepare_images(frame_paths, **image_prep)
     
     # 分批处理
     max_batch_size = 5
@@ -249,104 +153,267 @@ def analyze_frames(frame_paths, model_name=None, prompt=None):
     for i in range(0, len(frame_paths), max_batch_size):
         batch = frame_paths[i:i+max_batch_size]
         
-        response = client.generate(
-            model=model_name,
-            prompt=prompt,
-            images=batch,
-            options=options
-        )
+        started = time.perf_counter()
+        response = session.generate(model_name, prompt, batch)
+        if usage is not None:
+            # 往返时间减去服务端处理时间即为排队(连接池、主机重试、服务端并发槽)的时间
+            elapsed = time.perf_counter() - started
+            server_seconds = (response.get('total_duration') or 0) / 1e9
+            usage.record(model_name, prompt_tokens=response.get('prompt_eval_count') or 0,
+                         completion_tokens=response.get('eval_count') or 0, images=len(batch),
+                         queue_wait=max(0.0, elapsed - server_seconds), latency=elapsed,
+                         server_seconds=server_seconds)
         responses.append(response['response'].strip())
-            
-    return " ".join(responses)
+    
+    description = " ".join(responses)
+    if cache is not None:
+        cache.put(cache_key, description)
+    return description
 
-def generate_report(analyses, video_name):
-    """生成简化报告"""
-    # 创建固定名称的输出文件夹
-    video_name_base = os.path.splitext(video_name)[0]
-    output_dir = os.path.join('output', video_name_base)
-    os.makedirs(output_dir, exist_ok=True)
+def analyze_frame_groups(frame_groups, model_name=None, prompt=None, max_concurrent=2, on_result=None, cache=None,
+                         image_prep=None, session=None, completed=None, usage=None, on_complete=None):
+    """并发分析关键帧组：同时保持max_concurrent个组在推理，结果按原顺序返回
     
-    report = f"## {os.path.splitext(video_name)[0]}\n"
-    report += "| 时间段 | 内容概述 |\n"
-    report += "|--------|----------|\n"
+    frame_groups可以是生成器，关键帧提取与推理因此可以流水线并行；
+    on_result(idx, desc)按组顺序回调；on_complete(idx, desc)在每组推理完成时立即回调(可能乱序)，
+    某组失败时其余在途组完成后仍会回调，再抛出错误；completed为{组序号: 描述}，
+    其中的组(可在生成器产出该组时填入)直接交付，不再请求模型
+    """
+    max_concurrent = max(1, int(max_concurrent))
+    results = []
+    finished = {}
+    in_flight = {}
+
+    def complete(done):
+        """取出已完成组的结果，返回第一个错误"""
+        error = None
+        for future in done:
+            idx = in_flight.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            finished[idx] = future.result()
+            if on_complete:
+                on_complete(idx, finished[idx])
+        return error
+
+    def collect(done):
+        error = complete(done)
+        if error is not None:
+            # 其他在途组的结果同样交付给on_complete，重新运行时无需再次请求
+            complete(wait(in_flight).done)
+            raise error
+        # 只按顺序交付，乱序完成的结果先暂存
+        while len(results) in finished:
+            idx = len(results)
+            results.append(finished.pop(idx))
+            if on_result:
+                on_result(idx, results[idx])
+
+    with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+        for idx, frame_group in enumerate(frame_groups):
+            if completed and idx in completed:
+                finished[idx] = completed.pop(idx)
+                collect(())
+                continue
+            if len(in_flight) >= max_concurrent:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(analyze_frames, frame_group, model_name=model_name,
+                                     prompt=prompt, cache=cache, image_prep=image_prep, session=session,
+                                     usage=usage)
+            in_flight[future] = idx
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+    
+    return results
+
+def get_video_duration(video_path):
+    """获取视频时长(秒)"""
+    return media_probe.get_duration(video_path)
+
+def analyze_video(video_path, temp_dir, model_name=None, prompt=None, max_concurrent=2, stream_frames=True,
+                  cache=None, frame_filter=None, segmentation=None, report_flush_interval=5.0, on_progress=None,
+                  image_prep=None, session=None, subtitle_path=None, output_root='output', journal=True,
+                  meter=None):
+    """边提取关键帧边分析，返回报告路径
+    
+    temp_dir、subtitle_path和output_root都由调用方显式指定，多个视频可在各自的工作区并行分析；
+    stream_frames为True时关键帧经管道直接进入内存，否则写入temp_dir再读取；
+    frame_filter为filter_frames的参数字典，传入时先剔除空白帧和近似重复帧再送入模型；
+    segmentation为segment_shots的参数字典，关键帧按镜头边界分组并带真实时间戳；
+    image_prep为prepare_images的参数字典，控制发送给模型的图像尺寸和拼图方式；
+    session为共享的OllamaSession，在多个视频之间复用连接和已加载的模型；
+    on_progress额外接收FFmpeg提取进度事件(见keyframe_stream.build_progress_event)；
+    journal为True时每完成一组写入检查点，中断后重新分析同一视频会跳过已完成的组；
+    meter(UsageMeter)按集记录每次模型请求的用量
+    """
+    video_file = os.path.basename(video_path)
+    video_name = os.path.splitext(video_file)[0]
+    
+    # 先处理字幕并确保完成
+    subtitle_file = process_subtitles(video_path, subtitle_path=subtitle_path, output_root=output_root)
+    if subtitle_file:
+        print(f"已生成字幕文件: {subtitle_file}")
+    
+    duration = get_video_duration(video_path)
+    
+    # 提取进度(FFmpeg stderr线程)与分析进度(主线程)合并显示在同一行
+    status = {'extraction': '等待FFmpeg...', 'analysis': ''}
+    status_lock = threading.Lock()
+
+    def show_status():
+        with status_lock:
+            print(f"\r[提取进度] {status['extraction']} [处理进度] {status['analysis']}", end="", flush=True)
+
+    def on_extraction_progress(event):
+        status['extraction'] = format_extraction_progress(event)
+        show_status()
+        if on_progress:
+            on_progress(event)
     
-    video_path = os.path.join('input/video_input', video_name)
-    report_path = os.path.join(output_dir, 'report.txt')
-    duration = float(subprocess.run([
-        'ffprobe',
-        '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        video_path
-    ], capture_output=True, text=True).stdout)
+    if stream_frames:
+        frames = stream_keyframes(video_path, duration=duration, on_progress=on_extraction_progress)
+    else:
+        # 清理上一个视频残留的关键帧，避免被当作本视频的帧读入
+        if os.path.exists(temp_dir):
+            for frame in os.listdir(temp_dir):
+                os.remove(os.path.join(temp_dir, frame))
+        
+        frames = stream_keyframes(video_path, output_dir=temp_dir, duration=duration,
+                                  on_progress=on_extraction_progress)
+    source = frames
+    filter_stats = {}
+    if frame_filter is not None:
+        frames = filter_frames(frames, stats=filter_stats, **frame_filter)
+    groups = segment_shots(frames, duration=duration, **(segmentation or {}))
     
-    segment_duration = duration / len(analyses)
+    checkpoint = None
+    if journal:
+        fingerprint = make_fingerprint(video_path, model_name=model_name, prompt=prompt, frame_filter=frame_filter,
+                                       segmentation=segmentation, image_prep=image_prep)
+        checkpoint = AnalysisJournal(os.path.join(output_root, video_name, JOURNAL_FILENAME), fingerprint)
+    resumed = {}
+
+    # 组在提取线程中产生、在结果回调中取出，两者都运行在主线程
+    pending_groups = {}
+
+    def iter_group_images():
+        for group in groups:
+            pending_groups[group['index']] = group
+            desc = checkpoint.lookup(group['index'], group) if checkpoint else None
+            if desc is not None:
+                # 检查点中已完成的组不再解码图像和请求模型
+                resumed[group['index']] = desc
+                yield []
+            else:
+                yield [frame['image'] for frame in group['frames']]
     
-    for i, desc in enumerate(analyses):
-        start_seconds = i * segment_duration
-        end_seconds = (i + 1) * segment_duration
-        start_time = str(timedelta(seconds=start_seconds))  
-        end_time = str(timedelta(seconds=end_seconds))
-        time_range = f"{start_time}-{end_time}"
-        report += f"| {time_range} | {desc} |\n"
+    report = ReportWriter(video_file, output_root=output_root, flush_interval=report_flush_interval)
+
+    def on_complete(group_idx, desc):
+        # 每组完成即写入检查点，不等待前面较慢的组
+        if checkpoint and group_idx not in checkpoint.completed:
+            checkpoint.append(group_idx, pending_groups[group_idx], desc)
+
+    def on_result(group_idx, desc):
+        group = pending_groups.pop(group_idx)
+        # 显示清晰的进度信息
+        status['analysis'] = (f"已完成关键帧组 {group_idx+1} "
+                              f"({format_timestamp(group['start'])}-{format_timestamp(group['end'])}) "
+                              f"- 并发数: {max_concurrent}")
+        show_status()
+        report.add(group_idx, group['start'], group['end'], desc)
+
+    try:
+        analyze_frame_groups(iter_group_images(), model_name=model_name, prompt=prompt,
+                             max_concurrent=max_concurrent, on_result=on_result, on_complete=on_complete,
+                             cache=cache, image_prep=image_prep, session=session, completed=resumed,
+                             usage=meter.recorder('analyze', video_name) if meter else None)
+        report_path = report.finalize()
+        if checkpoint:
+            checkpoint.discard()
+    finally:
+        source.close()
+        report.close()
+        if checkpoint:
+            checkpoint.close()
     
-    with open(report_path, 'w', encoding='utf-8') as f:
-        f.write(report)
+    if filter_stats:
+        print(f"\n帧筛选: 共 {filter_stats['total']} 帧, 保留 {filter_stats['kept']} 帧, "
+              f"剔除空白帧 {filter_stats['blank']} 帧, 合并重复帧 {filter_stats['duplicate']} 帧")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"\n描述缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, "
+              f"命中率 {stats['hit_rate']:.0%}, 共 {stats['entries']} 条")
+    if session is not None:
+        stats = session.summary()
+        print(f"\n模型耗时(累计): 加载 {stats['load_seconds']:.2f}s, 推理 {stats['inference_seconds']:.2f}s "
+              f"({stats['calls']} 次请求, 平均 {stats['avg_inference_seconds']:.2f}s/次)")
+        for host, host_stats in stats.get('hosts', {}).items():
+            print(f"  {host}: {host_stats['requests']} 次请求, 失败 {host_stats['failures']} 次, "
+                  f"推理 {host_stats['inference_seconds']:.2f}s, 状态 {host_stats['state']}")
     
     return report_path
 
-def main():
+def load_settings(config):
+    """从config.json内容中读取analyze_video的参数"""
+    settings = {
+        'model_name': config.get('model_name'),
+        'prompt': config.get('prompt'),
+        'max_concurrent': config.get('max_concurrent_frames', 2),
+        'stream_frames': config.get('stream_keyframes', True),
+        'report_flush_interval': config.get('report_flush_interval', 5.0),
+        'journal': config.get('resume_from_journal', True),
+        'frame_filter': None
+    }
+    filter_config = config.get('frame_filter', {})
+    if filter_config.get('enabled', True):
+        settings['frame_filter'] = {key: filter_config[key] for key in ('hash_distance', 'black_luma', 'flat_std')
+                                    if key in filter_config}
+    segment_config = config.get('shot_segmentation', {})
+    settings['segmentation'] = {key: segment_config[key] for key in ('shot_distance', 'min_frames', 'max_frames')
+                                if key in segment_config}
+    prep_config = config.get('image_prep', {})
+    settings['image_prep'] = {key: prep_config[key] for key in ('mode', 'max_side', 'quality') if key in prep_config}
+    return settings
+
+def main(video_paths=None, subtitle_path=None):
+    """分析视频并生成AI报告
+
+    video_paths为要分析的视频路径(直接读取源文件，无需复制)；
+    未指定时分析input/video_input目录下的所有视频
+    """
     
     # 读取配置文件
-    prompt = None
-    model_name = None
-    max_concurrent = 2
-    processing_interval = 1.0
-    min_memory_mb = 1000
-    
+    config = {}
     if os.path.exists('src/config.json'):
         with open('src/config.json', 'r', encoding='utf-8') as f:
             config = json.load(f)
-            prompt = config.get('prompt')
-            model_name = config.get('model_name')
-            max_concurrent = config.get('max_concurrent_frames', 2)
-            processing_interval = config.get('processing_interval', 1.0)
-            min_memory_mb = config.get('min_free_memory_mb', 1000)
+    settings = load_settings(config)
 
     temp_dir = 'temp_frames'
     input_dir = 'input/video_input'
     
-    if not os.path.exists(input_dir):
-        raise FileNotFoundError(f"输入目录 {input_dir} 不存在")
-        
-    video_files = [f for f in os.listdir(input_dir) if f.endswith(('.mp4', '.mkv', '.avi', '.mov'))]
-    if not video_files:
-        raise FileNotFoundError(f"输入目录 {input_dir} 中没有找到视频文件")
-    # 创建信号量控制并发
-    semaphore = threading.Semaphore(max_concurrent)
-    
-    analyses = []
-    for video_file in video_files:
-        video_path = os.path.join(input_dir, video_file)
-        extract_keyframes(video_path, temp_dir)
-        
-        frames = sorted(os.listdir(temp_dir))
-        total_frames = len(frames)
-        frame_groups = [frames[i:i+5] for i in range(0, len(frames), 5)]
-        
-        for group_idx, frame_group in enumerate(frame_groups):
-            frame_paths = [os.path.join(temp_dir, frame) for frame in frame_group]
-            # 显示清晰的进度信息
-            print(f"\r[处理进度] 关键帧组 {group_idx+1}/{len(frame_groups)} - 当前处理: {', '.join(frame_group)}", end="", flush=True)
-            
-            # 获取信号量
-            semaphore.acquire()
-            
-            desc = analyze_frames(frame_paths, model_name=model_name, prompt=prompt)
-
+    if not video_paths:
+        if not os.path.exists(input_dir):
+            raise FileNotFoundError(f"输入目录 {input_dir} 不存在")
             
-            analyses.append(desc)
-            report_path = generate_report(analyses, video_file)
+        video_files = [f for f in os.listdir(input_dir) if f.endswith(('.mp4', '.mkv', '.avi', '.mov'))]
+        if not video_files:
+            raise FileNotFoundError(f"输入目录 {input_dir} 中没有找到视频文件")
+        video_paths = [os.path.join(input_dir, video_file) for video_file in video_files]
+    for video_path in video_paths:
+        if not os.path.exists(video_path):
+            raise FileNotFoundError(f"视频文件 {video_path} 不存在")
+    cache = load_frame_cache(config)
+    session = vlm_router.load_router(config, settings['max_concurrent'])
+    meter = load_usage_meter(config)
+    report_paths = []
+    for video_path in video_paths:
+        report_paths.append(analyze_video(video_path, temp_dir, cache=cache, session=session,
+                                          subtitle_path=subtitle_path, meter=meter, **settings))
         
 
     print("清理临时文件...")
@@ -355,10 +422,18 @@ def main():
             os.remove(os.path.join(temp_dir, frame))
         os.rmdir(temp_dir)
 
-    # 自动运行AI分析处理器
+    # 自动运行AI分析处理器，逐个处理本次生成的分析文件夹
     import ai_auto_processor
-    ai_auto_processor.main()
+    for report_path in report_paths:
+        ai_auto_processor.generate_report(os.path.dirname(report_path))
+    print_cache_stats(config)
+    if meter is not None:
+        meter.write_summary()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="分析视频关键帧并生成报告")
+    parser.add_argument('videos', nargs='*', help="视频文件路径，省略时分析input/video_input目录")
+    parser.add_argument('--subtitle', help="字幕文件路径(.ass或.txt)，省略时使用视频目录下的.ass文件")
+    args = parser.parse_args()
+    main(args.videos, args.subtitle)
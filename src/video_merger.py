@@ -1,6 +1,7 @@
 import os
 import subprocess
 from pathlib import Path
+import media_probe
 
 def extract_song_name(audio_path):
     """从音频文件名中提取歌曲名（去掉序号和歌手）"""
@@ -72,14 +73,7 @@ def main():
     merged_video = merge_videos(video_files, output_dir)
     
     # 获取音乐时长
-    probe = subprocess.run([
-        "ffprobe",
-        "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "default=noprint_wrappers=1:nokey=1",
-        str(audio_file)
-    ], capture_output=True, text=True, check=True)
-    music_duration = float(probe.stdout.strip())
+    music_duration = media_probe.get_duration(audio_file)
     
     # 截取与音乐等长的视频
     trimmed_video = output_dir / "trimmed.mp4"
@@ -0,0 +1,246 @@
+import io
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+from ollama_client import OllamaSession
+import video_analyzer
+
+class MockOllamaServer:
+    """本地模拟的Ollama服务，实现/api/tags和/api/generate
+
+    每次推理耗时 = latency + per_image * 图像数 ± jitter，按failure_rate概率返回500；
+    server_parallel限制同时处理的请求数，模拟Ollama的OLLAMA_NUM_PARALLEL
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, per_image=0.05, failure_rate=0.0, server_parallel=4,
+                 load_time=1.0, model_name='minicpm-v'):
+        self.latency = latency
+        self.jitter = jitter
+        self.per_image = per_image
+        self.failure_rate = failure_rate
+        self.load_time = load_time
+        self.model_name = model_name
+        self.slots = threading.Semaphore(server_parallel)
+        self.requests = 0
+        self._loaded = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def unload(self):
+        """卸载全部模型，下一个请求重新计入加载时间"""
+        with self._lock:
+            self._loaded.clear()
+
+    def _generate(self, body):
+        """处理一次生成请求，返回(状态码, 响应)"""
+        model = body.get('model', self.model_name)
+        images = body.get('images') or []
+        with self._lock:
+            self.requests += 1
+            load_seconds = 0.0 if model in self._loaded else self.load_time
+            self._loaded.add(model)
+        with self.slots:
+            time.sleep(load_seconds)
+            if not body.get('prompt'):
+                # 空提示词只加载模型
+                elapsed = load_seconds
+                text = ''
+            else:
+                if random.random() < self.failure_rate:
+                    time.sleep(self.latency / 2)
+                    return 500, {'error': 'mock failure'}
+                elapsed = max(0.0, self.latency + self.per_image * len(images)
+                              + random.uniform(-self.jitter, self.jitter))
+                time.sleep(elapsed)
+                elapsed += load_seconds
+                text = f"模拟描述: {len(images)}张图像"
+        return 200, {
+            'model': model,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'response': text,
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int(elapsed * 1e9),
+            'load_duration': int(load_seconds * 1e9),
+            'prompt_eval_count': 64 * len(images) + 32,
+            'eval_count': len(text),
+        }
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self._send_json(200, {'models': [{'name': mock.model_name, 'model': mock.model_name}]})
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/api/generate':
+                    self._send_json(*mock._generate(body))
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+class TimedSession(OllamaSession):
+    """记录每次请求客户端侧延迟的会话；失败计数后返回空描述，保证压测跑完"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self.failures = 0
+
+    def generate(self, model_name, prompt, images):
+        start = time.perf_counter()
+        try:
+            response = super().generate(model_name, prompt, images)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            return {'response': ''}
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+def make_frames(count, width=360, height=202, seed=0):
+    """生成模拟关键帧(JPEG字节)"""
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        img = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=90)
+        frames.append(buffer.getvalue())
+    return frames
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def run_case(server, frames, concurrency, group_size, image_mode, model_name='minicpm-v'):
+    """用指定并发数、每组帧数和图像模式跑完一集，返回统计
+
+    每个组合都从模型未加载开始，先预热再计时，加载时间单独记在load_seconds中，
+    不计入整集耗时和延迟分位数
+    """
+    server.unload()
+    session = TimedSession(host=server.url, keep_alive='30m', max_connections=concurrency)
+    session.ensure_model(model_name)
+    groups = [frames[i:i + group_size] for i in range(0, len(frames), group_size)]
+    start = time.perf_counter()
+    video_analyzer.analyze_frame_groups(
+        iter(groups),
+        model_name=model_name,
+        prompt="基准测试",
+        max_concurrent=concurrency,
+        image_prep={'mode': image_mode},
+        session=session
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'group_size': group_size,
+        'image_mode': image_mode,
+        'groups': len(groups),
+        'failures': session.failures,
+        'episode_seconds': elapsed,
+        'groups_per_second': len(groups) / elapsed if elapsed else 0.0,
+        'p50_seconds': percentile(session.latencies, 50),
+        'p95_seconds': percentile(session.latencies, 95),
+        'load_seconds': session.summary()['load_seconds'],
+    }
+
+def run_benchmark(frame_count=100, concurrency_levels=(1, 2, 4, 8), group_sizes=(5,), image_modes=('original',),
+                  **server_options):
+    """对每种并发数/每组帧数/图像模式组合各跑一集，打印并返回结果"""
+    server = MockOllamaServer(**server_options).start()
+    frames = make_frames(frame_count)
+    results = []
+    try:
+        print(f"模拟Ollama服务: {server.url}, 关键帧 {frame_count} 张")
+        print("| 并发 | 每组帧数 | 图像模式 | 组数 | 失败 | 模型加载(s) | 整集耗时(s) | 组/秒 | p50(s) | p95(s) |")
+        print("|------|----------|----------|------|------|-------------|-------------|-------|--------|--------|")
+        for image_mode in image_modes:
+            for group_size in group_sizes:
+                for concurrency in concurrency_levels:
+                    r = run_case(server, frames, concurrency, group_size, image_mode)
+                    results.append(r)
+                    print(f"| {r['concurrency']} | {r['group_size']} | {r['image_mode']} | {r['groups']} "
+                          f"| {r['failures']} | {r['load_seconds']:.2f} | {r['episode_seconds']:.2f} | {r['groups_per_second']:.2f} "
+                          f"| {r['p50_seconds']:.3f} | {r['p95_seconds']:.3f} |")
+    finally:
+        server.stop()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="视觉模型分析吞吐量基准测试(使用本地模拟Ollama服务)")
+    parser.add_argument('--frames', type=int, default=100, help="模拟一集的关键帧数")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help="测试的并发数")
+    parser.add_argument('--group-sizes', type=int, nargs='+', default=[5], help="测试的每组帧数")
+    parser.add_argument('--modes', nargs='+', default=['original'], choices=['original', 'frames', 'tile'],
+                        help="测试的图像模式")
+    parser.add_argument('--latency', type=float, default=0.2, help="模拟每次推理的基础延迟(秒)")
+    parser.add_argument('--jitter', type=float, default=0.05, help="延迟随机抖动(秒)")
+    parser.add_argument('--per-image', type=float, default=0.05, help="每张图像增加的延迟(秒)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="请求失败概率(0-1)")
+    parser.add_argument('--server-parallel', type=int, default=4, help="模拟服务端同时处理的请求数")
+    parser.add_argument('--output', help="把结果另存为JSON文件")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        frame_count=args.frames,
+        concurrency_levels=args.concurrency,
+        group_sizes=args.group_sizes,
+        image_modes=args.modes,
+        latency=args.latency,
+        jitter=args.jitter,
+        per_image=args.per_image,
+        failure_rate=args.failure_rate,
+        server_parallel=args.server_parallel
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
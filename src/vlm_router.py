@@ -0,0 +1,173 @@
+import time
+import random
+import threading
+import httpx
+import ollama
+
+from ollama_client import load_session, DEFAULT_HOST
+
+class HostState:
+    """单个推理主机的负载与熔断状态"""
+
+    def __init__(self, session, failure_threshold, cooldown):
+        self.session = session
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False  # 半开状态下是否已有试探请求
+
+    @property
+    def host(self):
+        return self.session.host
+
+    def state(self, now):
+        if self.consecutive_failures < self.failure_threshold:
+            return 'closed'
+        return 'open' if now < self.open_until else 'half_open'
+
+    def available(self, now):
+        state = self.state(now)
+        return state == 'closed' or (state == 'half_open' and not self.probing)
+
+def is_retryable(error):
+    """连接错误、超时、429和5xx可以换主机重试；其余错误(如模型不存在)直接抛出"""
+    if isinstance(error, (httpx.TransportError, ConnectionError)):
+        return True
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+class VlmRouter:
+    """多台Ollama主机之间的请求路由
+
+    每个关键帧组发往当前在途请求最少的健康主机；失败的组以指数退避换主机重试，
+    连续失败failure_threshold次的主机熔断cooldown秒，之后放行一个试探请求，
+    成功即恢复。接口与OllamaSession相同，可直接传给analyze_frames
+    """
+
+    def __init__(self, sessions, max_attempts=5, backoff_base=1.0, backoff_max=30.0,
+                 failure_threshold=3, cooldown=30.0):
+        if not sessions:
+            raise ValueError("至少需要一个Ollama主机")
+        self.hosts = [HostState(session, failure_threshold, cooldown) for session in sessions]
+        self.options = sessions[0].options
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        # 试探请求结束或主机状态变化时唤醒等待可用主机的线程
+        self._host_changed = threading.Condition(self._lock)
+
+    def _wait_timeout(self, now):
+        """没有可用主机时的最长等待时间: 熔断中的主机等到冷却结束，正在试探的主机最多等一个冷却期"""
+        timeouts = [h.open_until - now if h.state(now) == 'open' else h.cooldown for h in self.hosts]
+        return max(0.01, min(timeouts))
+
+    def _acquire(self, exclude):
+        """选出在途请求最少的可用主机，优先避开刚失败过的主机；没有可用主机时阻塞等待"""
+        with self._host_changed:
+            while True:
+                now = time.monotonic()
+                candidates = [h for h in self.hosts if h.available(now)]
+                preferred = [h for h in candidates if h not in exclude] or candidates
+                if preferred:
+                    break
+                self._host_changed.wait(self._wait_timeout(now))
+            host = min(preferred, key=lambda h: (h.in_flight, h.requests))
+            if host.state(now) == 'half_open':
+                host.probing = True
+            host.in_flight += 1
+            host.requests += 1
+            return host
+
+    def _release(self, host, success):
+        """请求结束后更新主机状态；success为None表示结果不能说明主机好坏(如模型不存在)，不改变失败计数"""
+        with self._host_changed:
+            host.in_flight -= 1
+            host.probing = False
+            self._host_changed.notify_all()
+            if success is None:
+                return
+            if success:
+                host.consecutive_failures = 0
+                return
+            host.failures += 1
+            host.consecutive_failures += 1
+            if host.consecutive_failures >= host.failure_threshold:
+                host.open_until = time.monotonic() + host.cooldown
+                print(f"\n警告: 主机 {host.host} 连续失败 {host.consecutive_failures} 次，熔断 {host.cooldown:.0f}s")
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def generate(self, model_name, prompt, images):
+        """把一次推理请求路由到某台主机，必要时换主机重试
+
+        只有实际发出的请求计入max_attempts，等待熔断主机恢复不消耗重试次数
+        """
+        last_error = None
+        tried = set()
+        for attempt in range(self.max_attempts):
+            host = self._acquire(tried)
+            try:
+                response = host.session.generate(model_name, prompt, images)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._release(host, success=None)
+                    raise
+                self._release(host, success=False)
+                tried.add(host)
+                last_error = e
+                if attempt + 1 < self.max_attempts:
+                    print(f"\n主机 {host.host} 请求失败({type(e).__name__}: {e})，第 {attempt+1} 次重试")
+                    time.sleep(self._backoff(attempt))
+                continue
+            self._release(host, success=True)
+            return response
+        print(f"\n所有Ollama主机均请求失败，已用完 {self.max_attempts} 次尝试，不再重试"
+              f"(最后一次错误 {type(last_error).__name__}: {last_error})")
+        raise RuntimeError(f"所有Ollama主机均请求失败(已尝试 {self.max_attempts} 次): {last_error}")
+
+    def summary(self):
+        """汇总各主机的耗时与健康状态"""
+        now = time.monotonic()
+        totals = {'calls': 0, 'load_seconds': 0.0, 'warmup_seconds': 0.0, 'inference_seconds': 0.0}
+        hosts = {}
+        for h in self.hosts:
+            stats = h.session.summary()
+            for key in totals:
+                totals[key] += stats[key]
+            with self._lock:
+                hosts[h.host] = {
+                    'requests': h.requests,
+                    'failures': h.failures,
+                    'in_flight': h.in_flight,
+                    'state': h.state(now),
+                    'inference_seconds': stats['inference_seconds']
+                }
+        totals['avg_inference_seconds'] = totals['inference_seconds'] / totals['calls'] if totals['calls'] else 0.0
+        totals['hosts'] = hosts
+        return totals
+
+def load_router(config, max_concurrent=1):
+    """按config.json的ollama配置创建路由；hosts未配置时只使用base_url一台主机
+
+    各主机的会话都由ollama_client.load_session创建，与单机时共用同一套参数和预热逻辑
+    """
+    ollama_config = config.get('ollama', {})
+    hosts = ollama_config.get('hosts') or [ollama_config.get('base_url', DEFAULT_HOST)]
+    sessions = [load_session(config, max_concurrent, host=host) for host in hosts]
+    router_config = ollama_config.get('router', {})
+    return VlmRouter(
+        sessions,
+        max_attempts=router_config.get('max_attempts', 5),
+        backoff_base=router_config.get('backoff_base', 1.0),
+        backoff_max=router_config.get('backoff_max', 30.0),
+        failure_threshold=router_config.get('failure_threshold', 3),
+        cooldown=router_config.get('cooldown', 30.0)
+    )
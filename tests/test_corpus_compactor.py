@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from corpus_compactor import compact_corpus, LEVELS
+
+REPORT_HEADER = "| 时间段 | 核心内容 | 集数+时间码 | 画面描述 |\n|------|------|------|------|\n"
+
+def write_corpus(directory, shots=40, music_lines=200):
+    rows = []
+    for i in range(shots):
+        start, end = i * 10, i * 10 + 8
+        rows.append(f"| 00:{start // 60:02d}:{start % 60:02d}-00:{end // 60:02d}:{end % 60:02d} "
+                    f"| 第{i}个镜头的核心剧情内容描述 | 1集 00:{start // 60:02d}:{start % 60:02d} "
+                    f"| 镜头{i}的画面里人物在教室中交谈并看向窗外 |")
+    with open(os.path.join(directory, '[01]_ai_report.txt'), 'w', encoding='utf-8') as f:
+        f.write(REPORT_HEADER + '\n'.join(rows))
+    with open(os.path.join(directory, 'music_report.md'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(f"| {i} | 歌词第{i}句的节奏与情绪分析 |" for i in range(music_lines)))
+
+class CompactCorpusBudgetTest(unittest.TestCase):
+
+    def test_fixed_files_over_budget_still_compact_reports(self):
+        """其他文件已超出预算时报告仍按最高级别压缩，而不是被当作不限制预算"""
+        with tempfile.TemporaryDirectory() as directory:
+            write_corpus(directory)
+            _, unlimited = compact_corpus(directory)
+            _, fitting = compact_corpus(directory, token_budget=unlimited['tokens'] // 2)
+            _, over = compact_corpus(directory, token_budget=1)
+
+        self.assertEqual(unlimited['level'], 0)
+        self.assertEqual(over['level'], len(LEVELS) - 1)
+        self.assertGreater(over['dropped'], 0)
+        self.assertLess(over['tokens'], unlimited['tokens'])
+        self.assertLessEqual(over['tokens'], fitting['tokens'])
+
+if __name__ == '__main__':
+    unittest.main()